@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""
+Measure the dispatch pipeline (hook lookup, conditions, serialization,
+encoding, signing) without network I/O, using the in-memory transport.
+
+Events are fired for a user instance subscribed to by --hooks hooks, both as
+model events (serialized by the default serializer) and as raw events with a
+--payload-size byte payload; the median time per event is reported.
+
+    python benchmarks/dispatch.py --hooks 100 --events 200
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import django
+from django.conf import settings
+
+
+def setup():
+    settings.configure(
+        DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}},
+        INSTALLED_APPS=['django.contrib.auth', 'django.contrib.contenttypes', 'rest_hooks'],
+        HOOK_EVENTS={
+            'user.pinged': 'auth.User.pinged',
+            'user.raw': None,
+        },
+        HOOK_TRANSPORT='rest_hooks.transports.InMemoryTransport',
+        SECRET_KEY='benchmark',
+        USE_TZ=True,
+    )
+    django.setup()
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0)
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def measure(fire, events, transport):
+    timings = []
+    for _ in range(events):
+        started = time.time()
+        fire()
+        timings.append(time.time() - started)
+    deliveries = len(transport.outbox)
+    transport.clear()
+    return median(timings), deliveries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--hooks', type=int, default=100)
+    parser.add_argument('--events', type=int, default=200)
+    parser.add_argument('--payload-size', type=int, default=1024)
+    parser.add_argument('--signed', action='store_true', help='Give every hook a secret.')
+    args = parser.parse_args()
+
+    setup()
+    from django.contrib.auth.models import User
+    from rest_hooks.models import Hook
+    from rest_hooks.signals import hook_event, raw_hook_event
+    from rest_hooks.transports import get_transport
+
+    user = User.objects.create(username='benchmark')
+    Hook.objects.bulk_subscribe([
+        {'user': user, 'event': event, 'target': 'http://example.com/{0}'.format(n),
+         'secret': 'secret' if args.signed else ''}
+        for event in ('user.pinged', 'user.raw')
+        for n in range(args.hooks)
+    ])
+    transport = get_transport()
+    payload = {'padding': 'x' * args.payload_size}
+
+    results = [
+        ('model event', measure(
+            lambda: hook_event.send(sender=User, action='pinged', instance=user), args.events, transport)),
+        ('raw event', measure(
+            lambda: raw_hook_event.send(sender=None, event_name='user.raw', payload=payload, user=user),
+            args.events, transport)),
+    ]
+
+    print('{0} hooks per event, {1} events{2}'.format(args.hooks, args.events, ', signed' if args.signed else ''))
+    for name, (seconds, deliveries) in results:
+        print('{0:<12} {1:8.3f} ms/event  {2:8.1f} us/delivery  ({3} deliveries)'.format(
+            name, seconds * 1000, seconds * 1e6 / max(args.hooks, 1), deliveries))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""
+Measure what adding 'rest_hooks' to INSTALLED_APPS costs at startup.
+
+Each run is a fresh interpreter calling django.setup() with and without
+rest_hooks installed; the median difference is reported together with the
+modules that only get imported because of rest_hooks.
+
+    python benchmarks/import_time.py --runs 20
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+
+CHILD = r'''
+import json, sys, time
+import django
+from django.conf import settings
+
+apps = ['django.contrib.auth', 'django.contrib.contenttypes']
+if sys.argv[1] == '1':
+    apps.append('rest_hooks')
+settings.configure(
+    DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}},
+    INSTALLED_APPS=apps,
+    HOOK_EVENTS={'user.added': 'auth.User.created'},
+    SECRET_KEY='benchmark',
+)
+before = set(sys.modules)
+started = time.time()
+django.setup()
+elapsed = time.time() - started
+print(json.dumps({'seconds': elapsed, 'modules': sorted(set(sys.modules) - before)}))
+'''
+
+
+def run(with_rest_hooks):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=root + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    output = subprocess.check_output(
+        [sys.executable, '-c', CHILD, '1' if with_rest_hooks else '0'], env=env
+    )
+    return json.loads(output.decode('utf-8'))
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    baseline = [run(False) for _ in range(args.runs)]
+    installed = [run(True) for _ in range(args.runs)]
+
+    baseline_seconds = median([result['seconds'] for result in baseline])
+    installed_seconds = median([result['seconds'] for result in installed])
+    extra_modules = sorted(set(installed[0]['modules']) - set(baseline[0]['modules']))
+
+    print('django.setup() without rest_hooks: {0:8.2f} ms'.format(baseline_seconds * 1000))
+    print('django.setup() with rest_hooks:    {0:8.2f} ms'.format(installed_seconds * 1000))
+    print('cost of rest_hooks:                {0:8.2f} ms'.format((installed_seconds - baseline_seconds) * 1000))
+    print('extra modules imported:            {0}'.format(len(extra_modules)))
+    for name in ('requests', 'rest_hooks.client'):
+        print('  {0} imported: {1}'.format(name, name in extra_modules))
+
+
+if __name__ == '__main__':
+    main()
@@ -1 +1,3 @@
 VERSION = (1, 6, 0)
+
+default_app_config = 'rest_hooks.apps.RestHooksConfig'
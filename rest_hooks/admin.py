@@ -1,7 +1,16 @@
 from django.contrib import admin
+from django.contrib.admin import helpers
+from django.core.exceptions import PermissionDenied
 from django.conf import settings
 from django import forms
-from rest_hooks.utils import get_hook_model
+from django.core.paginator import Paginator
+from django.db import connections
+from django.template.response import TemplateResponse
+from django.utils.functional import cached_property
+
+from rest_hooks.models import DeliveryLog
+from rest_hooks.signals import hooks_bulk_changed
+from rest_hooks.utils import delete_in_chunks, get_hook_model, get_log_database
 
 if getattr(settings, 'HOOK_EVENTS', None) is None:
     raise Exception("You need to define settings.HOOK_EVENTS!")
@@ -9,6 +18,8 @@ if getattr(settings, 'HOOK_EVENTS', None) is None:
 
 HookModel = get_hook_model()
 
+_admin_events = (None, None)
+
 
 class HookForm(forms.ModelForm):
     """
@@ -19,7 +30,7 @@ class HookForm(forms.ModelForm):
 
     class Meta:
         model = HookModel
-        fields = ['user', 'target', 'event']
+        fields = ['user', 'target', 'event', 'is_active', 'condition', 'payload_fields', 'secret']
 
     def __init__(self, *args, **kwargs):
         super(HookForm, self).__init__(*args, **kwargs)
@@ -27,13 +38,152 @@ class HookForm(forms.ModelForm):
 
     @classmethod
     def get_admin_events(cls):
-        return [(x, x) for x in getattr(settings, 'HOOK_EVENTS', None).keys()]
+        """
+        The event choices, built once per `settings.HOOK_EVENTS` object.
+        """
+        global _admin_events
+        hook_events = getattr(settings, 'HOOK_EVENTS', None)
+        if _admin_events[0] is not hook_events:
+            _admin_events = (hook_events, [(x, x) for x in sorted(hook_events.keys())])
+        return _admin_events[1]
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Uses the planner's row estimate instead of a COUNT(*) scan for
+    unfiltered changelists of large PostgreSQL tables.
+    """
+    estimate_threshold = 10000
+
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, 'query', None)
+        if query is not None and not query.where:
+            estimate = self.estimated_count()
+            if estimate is not None and estimate >= self.estimate_threshold:
+                return estimate
+        return super(EstimatedCountPaginator, self).count
+
+    def estimated_count(self):
+        connection = connections[self.object_list.db]
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                [self.object_list.model._meta.db_table]
+            )
+            row = cursor.fetchone()
+        return int(row[0]) if row else None
+
+
+class EventListFilter(admin.SimpleListFilter):
+    """
+    Filter on the events in settings.HOOK_EVENTS, without the
+    `SELECT DISTINCT` over the whole table a plain field filter runs.
+    """
+    title = 'event'
+    parameter_name = 'event'
+
+    def lookups(self, request, model_admin):
+        return HookForm.get_admin_events()
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(event=self.value())
+        return queryset
+
+
+def update_hooks(modeladmin, request, queryset, is_active):
+    # allowed_permissions only exists in Django >= 2.1
+    if not modeladmin.has_change_permission(request):
+        raise PermissionDenied
+    # a single UPDATE, no objects are loaded
+    count = queryset.update(is_active=is_active)
+    hooks_bulk_changed.send(sender=modeladmin.model, action='enable' if is_active else 'disable')
+    modeladmin.message_user(request, '{0} {1} hooks.'.format('Enabled' if is_active else 'Disabled', count))
+
+
+def enable_hooks(modeladmin, request, queryset):
+    update_hooks(modeladmin, request, queryset, True)
+enable_hooks.short_description = 'Enable selected hooks'
+enable_hooks.allowed_permissions = ('change',)
+
+
+def disable_hooks(modeladmin, request, queryset):
+    update_hooks(modeladmin, request, queryset, False)
+disable_hooks.short_description = 'Disable selected hooks'
+disable_hooks.allowed_permissions = ('change',)
+
+
+def delete_hooks(modeladmin, request, queryset):
+    """
+    Delete the selected hooks with one DELETE per chunk, after a
+    confirmation page that only counts them (`delete_selected` lists every
+    object, and loads them all again to log and delete them one by one).
+    """
+    if not modeladmin.has_delete_permission(request):
+        raise PermissionDenied
+    if request.POST.get('post'):
+        count = delete_in_chunks(queryset, raw=True)
+        hooks_bulk_changed.send(sender=modeladmin.model, action='unsubscribe')
+        modeladmin.message_user(request, 'Deleted {0} hooks.'.format(count))
+        return None
+
+    context = {
+        'title': 'Are you sure?',
+        'opts': modeladmin.model._meta,
+        'count': queryset.count(),
+        # only the checkboxes of the page, "select all" is passed on as is
+        'selected': request.POST.getlist(helpers.ACTION_CHECKBOX_NAME),
+        'select_across': request.POST.get('select_across') == '1',
+        'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+    }
+    try:
+        context.update(modeladmin.admin_site.each_context(request))
+    except (AttributeError, TypeError):
+        # Django < 1.8
+        pass
+    return TemplateResponse(request, 'rest_hooks/delete_hooks_confirmation.html', context)
+delete_hooks.short_description = 'Delete selected hooks'
+delete_hooks.allowed_permissions = ('delete',)
 
 
 class HookAdmin(admin.ModelAdmin):
-    list_display = [f.name for f in HookModel._meta.fields]
+    list_display = ['id', 'event', 'target', 'user', 'is_active', 'created', 'updated']
+    list_select_related = ['user']
+    list_filter = [EventListFilter, 'is_active']
+    search_fields = ['^target']
     raw_id_fields = ['user', ]
+    actions = [enable_hooks, disable_hooks, delete_hooks]
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     form = HookForm
 
+    def get_actions(self, request):
+        actions = super(HookAdmin, self).get_actions(request)
+        # replaced by delete_hooks
+        actions.pop('delete_selected', None)
+        return actions
+
+
+class DeliveryLogAdmin(admin.ModelAdmin):
+    list_display = ['created', 'hook_id', 'event', 'target', 'status', 'latency', 'attempt']
+    list_filter = ['status', EventListFilter]
+    search_fields = ['^target']
+    date_hierarchy = 'created'
+    readonly_fields = [f.name for f in DeliveryLog._meta.fields]
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        queryset = super(DeliveryLogAdmin, self).get_queryset(request)
+        using = get_log_database()
+        return queryset.using(using) if using is not None else queryset
+
+    def has_add_permission(self, request):
+        return False
+
 
 admin.site.register(HookModel, HookAdmin)
+admin.site.register(DeliveryLog, DeliveryLogAdmin)
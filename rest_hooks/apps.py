@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class RestHooksConfig(AppConfig):
+    name = 'rest_hooks'
+
+    def ready(self):
+        from rest_hooks.models import connect_signals
+        connect_signals()
@@ -1,5 +1,11 @@
+import atexit
+import heapq
+import itertools
+import os
+import random
 import threading
 import collections
+import time
 
 import requests
 
@@ -7,27 +13,194 @@ import requests
 class FlushThread(threading.Thread):
     def __init__(self, client):
         threading.Thread.__init__(self)
+        # idle workers may block indefinitely, Client.close() drains at exit
+        self.daemon = True
         self.client = client
 
     def run(self):
-        self.client.sync_flush()
+        self.client.stats.worker_started()
+        try:
+            self.client.work()
+        finally:
+            self.client.stats.worker_stopped()
+
+
+class ClientStats(object):
+    """
+    Thread-safe delivery counters for a `Client`.
+
+    Every counter update happens under a single lock, so totals stay exact
+    no matter how many `FlushThread`s are sending at once.
+    """
+    COUNTERS = ('enqueued', 'sent', 'failed', 'retried', 'dropped')
+
+    # weight of the newest sample in the moving latency average
+    LATENCY_WEIGHT = 0.2
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = dict((name, 0) for name in self.COUNTERS)
+        self.active_workers = 0
+        self.latency = None
+
+    def incr(self, name, amount=1):
+        with self.lock:
+            self.counts[name] += amount
+
+    def record_latency(self, seconds):
+        with self.lock:
+            if self.latency is None:
+                self.latency = seconds
+            else:
+                self.latency += self.LATENCY_WEIGHT * (seconds - self.latency)
+
+    def worker_started(self):
+        with self.lock:
+            self.active_workers += 1
+
+    def worker_stopped(self):
+        with self.lock:
+            self.active_workers -= 1
+
+    def __getitem__(self, name):
+        return self.counts[name]
+
+    def snapshot(self):
+        with self.lock:
+            data = dict(self.counts)
+            data['active_workers'] = self.active_workers
+            data['latency'] = self.latency
+        return data
+
+
+def request_size(kwargs):
+    """
+    The bytes of the body a queued request holds on to.
+    """
+    data = kwargs.get('data')
+    return len(data) if isinstance(data, (bytes, type(u''))) else 0
 
 
 class Client(object):
     """
-    Manages a simple pool of threads to flush the queue of requests.
+    Manages an adaptive pool of threads to flush the queue of requests.
+
+    The pool grows one thread at a time, up to `max_threads`, whenever the
+    backlog - queue depth times the average request latency, per worker -
+    exceeds `max_backlog` seconds. Workers that stay idle for `idle_timeout`
+    seconds exit again, down to `min_threads`.
+
+    Connection errors, 5xx and 429 responses are retried up to
+    `max_attempts` attempts in total. Retries wait in a heap ordered by due
+    time, with exponential backoff from `retry_base_delay` capped at
+    `retry_max_delay` and jittered, so they never hold up fresh requests. At
+    most `max_pending_retries` retries, and `max_pending_retry_bytes` bytes
+    of request bodies, are held; a `Retry-After` longer than
+    `retry_max_delay` isn't waited for. Requests that can't be retried any
+    more are counted as dropped and handed to the `dead_letter`
+    callable as `dead_letter(method, args, kwargs, response=..., exception=...,
+    attempts=...)`.
+
+    Requests may carry a `context` keyword, which isn't sent but passed to
+    the `on_result` callable after every attempt as `on_result(context,
+    response=..., exception=..., latency=..., attempt=...)`.
+
+    A process forked from one that used the client (prefork servers and
+    workers) starts over with an empty queue and a pool of its own, the
+    parent's threads don't survive the fork.
+
+    `num_threads` is kept as an alias of `max_threads`.
     """
-    def __init__(self, num_threads=3):
+    def __init__(self, num_threads=3, min_threads=0, max_threads=None, idle_timeout=1.0, max_backlog=0.5,
+                 max_attempts=1, retry_base_delay=1.0, retry_max_delay=60.0, max_pending_retries=10000,
+                 max_pending_retry_bytes=50 * 1024 * 1024, dead_letter=None, on_result=None):
         self.queue = collections.deque()
+        self.retries = []
+        self.retry_sequence = itertools.count()
+        self.max_attempts = max_attempts
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.max_pending_retries = max_pending_retries
+        self.max_pending_retry_bytes = max_pending_retry_bytes
+        self.retry_bytes = 0
+        self.dead_letter = dead_letter
+        self.on_result = on_result
 
         self.flush_lock = threading.Lock()
-        self.num_threads = num_threads
-        self.flush_threads = [FlushThread(self) for _ in range(self.num_threads)]
-        self.total_sent = 0
+        self.has_work = threading.Condition(self.flush_lock)
+        self.max_threads = max(max_threads if max_threads is not None else num_threads, 1)
+        self.min_threads = min(min_threads, self.max_threads)
+        self.num_threads = self.max_threads
+        self.idle_timeout = idle_timeout
+        self.max_backlog = max_backlog
+        self.closing = False
+        self.stats = ClientStats()
+        atexit.register(self.close)
+        self.start_pool()
+
+    def start_pool(self):
+        self.pid = os.getpid()
+        self.flush_threads = []
+        self.workers = 0
+        self.idle_workers = 0
+        with self.flush_lock:
+            while self.workers < self.min_threads:
+                self.start_worker()
+
+    def check_fork(self):
+        """
+        In a forked child the inherited locks may be held and the worker
+        counters have no threads behind them: start from scratch. The
+        parent still sends what was queued before the fork.
+        """
+        if self.pid == os.getpid():
+            return
+        self.flush_lock = threading.Lock()
+        self.has_work = threading.Condition(self.flush_lock)
+        self.queue = collections.deque()
+        self.retries = []
+        self.retry_bytes = 0
+        self.stats = ClientStats()
+        self.start_pool()
+
+    @property
+    def total_sent(self):
+        return self.stats['sent']
 
     def enqueue(self, method, *args, **kwargs):
-        self.queue.append((method, args, kwargs))
-        self.refresh_threads()
+        context = kwargs.pop('context', None)
+        self.check_fork()
+        with self.flush_lock:
+            self.queue.append((method, args, kwargs, time.time(), 1, context))
+            self.stats.incr('enqueued')
+            if self.idle_workers:
+                self.has_work.notify()
+            else:
+                self.scale_up()
+
+    def enqueue_many(self, method, requests):
+        """
+        Queue a batch of requests, given as dicts of keyword arguments,
+        taking the lock once.
+        """
+        if not requests:
+            return
+        now = time.time()
+        self.check_fork()
+        with self.flush_lock:
+            for kwargs in requests:
+                kwargs = dict(kwargs)
+                context = kwargs.pop('context', None)
+                self.queue.append((method, (), kwargs, now, 1, context))
+            self.stats.incr('enqueued', len(requests))
+            if self.idle_workers:
+                self.has_work.notify(min(self.idle_workers, len(requests)))
+            # grow as far as the new backlog asks for at once
+            while True:
+                workers = self.workers
+                self.scale_up()
+                if self.workers == workers:
+                    break
 
     def get(self, *args, **kwargs):
         self.enqueue('get', *args, **kwargs)
@@ -41,18 +214,213 @@ class Client(object):
     def delete(self, *args, **kwargs):
         self.enqueue('delete', *args, **kwargs)
 
+    def backlog(self):
+        """
+        Estimated seconds the current workers need to drain the queue.
+        Until a latency has been measured every request counts as a full
+        `max_backlog`, so the pool grows with queue depth.
+        """
+        latency = self.stats.latency
+        if latency is None:
+            latency = self.max_backlog
+        return len(self.queue) * latency / max(self.workers, 1)
+
+    def start_worker(self):
+        # must hold flush_lock
+        self.workers += 1
+        thread = FlushThread(self)
+        self.flush_threads = [t for t in self.flush_threads if t.is_alive()] + [thread]
+        thread.start()
+
+    def scale_up(self):
+        # must hold flush_lock
+        if self.workers >= self.max_threads or self.closing:
+            return
+        if self.workers == 0 or self.backlog() > self.max_backlog:
+            self.start_worker()
+
     def refresh_threads(self):
         with self.flush_lock:
-            # refresh if there are jobs to do and no threads are alive
-            if len(self.queue) > 0:
-                to_refresh = [index for index, thread in enumerate(self.flush_threads) if not thread.is_alive()]
-                for index in to_refresh:
-                    self.flush_threads[index] = FlushThread(self)
-                    self.flush_threads[index].start()
+            if self.queue:
+                self.scale_up()
+
+    def next_request(self):
+        """
+        Block until there is a request to send, or return None once this
+        worker has been idle for `idle_timeout` and the pool can shrink.
+
+        Due retries go first, they have waited the longest.
+        """
+        with self.flush_lock:
+            deadline = time.time() + self.idle_timeout
+            while True:
+                now = time.time()
+                if self.retries and (self.closing or self.retries[0][0] <= now):
+                    return self.pop_retry()
+                if self.queue:
+                    return self.queue.pop()
+
+                if self.closing:
+                    remaining = 0
+                elif self.workers > self.min_threads:
+                    remaining = deadline - now
+                else:
+                    remaining = None
+                if remaining is not None and remaining <= 0:
+                    if not self.retries or self.workers > 1:
+                        self.workers -= 1
+                        return None
+                    # the last worker stays until the pending retries are done
+                    remaining = None
+                if self.retries:
+                    retry_in = self.retries[0][0] - now
+                    remaining = retry_in if remaining is None else min(remaining, retry_in)
+
+                self.idle_workers += 1
+                try:
+                    self.has_work.wait(remaining)
+                finally:
+                    self.idle_workers -= 1
+
+    def work(self):
+        session = requests.Session()
+        while True:
+            request = self.next_request()
+            if request is None:
+                return
+            self.send(session, request)
+
+    def send(self, session, request):
+        method, args, kwargs, enqueued_at, attempt, context = request
+        response = exception = None
+        started = time.time()
+        try:
+            response = getattr(session, method)(*args, **kwargs)
+        except Exception as e:
+            # a dead connection must not take the worker down with it
+            exception = e
+        latency = time.time() - started
+        self.stats.record_latency(latency)
+        self.report(context, response, exception, latency, attempt)
+
+        if exception is None and not self.should_retry(response):
+            self.stats.incr('sent')
+            return
+        self.stats.incr('failed')
+
+        retryable = exception is None or isinstance(exception, requests.RequestException)
+        if not retryable or attempt >= self.max_attempts or not self.schedule_retry(request, response):
+            self.give_up(request, response, exception)
+
+    def report(self, context, response, exception, latency, attempt):
+        if self.on_result is None:
+            return
+        try:
+            self.on_result(context, response=response, exception=exception, latency=latency, attempt=attempt)
+        except Exception:
+            pass
+
+    def should_retry(self, response):
+        return response is not None and (response.status_code >= 500 or response.status_code == 429)
+
+    def retry_delay(self, attempt, response=None):
+        """
+        Seconds to wait before `attempt`: exponential backoff with jitter,
+        at least the Retry-After the subscriber asked for. Only the backoff
+        is capped at `retry_max_delay`; `schedule_retry` gives up on longer
+        Retry-Afters rather than hold the request that long.
+        """
+        delay = min(self.retry_base_delay * 2 ** (attempt - 2), self.retry_max_delay)
+        delay = random.uniform(delay / 2.0, delay)
+        try:
+            retry_after = float(response.headers.get('Retry-After'))
+        except (AttributeError, TypeError, ValueError):
+            retry_after = 0
+        return max(delay, retry_after)
+
+    def schedule_retry(self, request, response=None):
+        """
+        Put the request on the retry heap, returns False if it's full or the
+        subscriber asked to wait longer than `retry_max_delay`.
+        """
+        method, args, kwargs, enqueued_at, attempt, context = request
+        delay = self.retry_delay(attempt + 1, response)
+        if delay > self.retry_max_delay:
+            return False
+        size = request_size(kwargs)
+        with self.flush_lock:
+            if (self.closing or len(self.retries) >= self.max_pending_retries or
+                    self.retry_bytes + size > self.max_pending_retry_bytes):
+                return False
+            retry = (method, args, kwargs, enqueued_at, attempt + 1, context)
+            heapq.heappush(self.retries, (time.time() + delay, next(self.retry_sequence), retry, size))
+            self.retry_bytes += size
+            self.stats.incr('retried')
+            # waiting workers need to recompute their timeout
+            self.has_work.notify()
+        return True
+
+    def pop_retry(self):
+        # must hold flush_lock
+        due, sequence, retry, size = heapq.heappop(self.retries)
+        self.retry_bytes -= size
+        return retry
+
+    def give_up(self, request, response=None, exception=None):
+        method, args, kwargs, enqueued_at, attempt, context = request
+        self.stats.incr('dropped')
+        if self.dead_letter is None:
+            return
+        try:
+            self.dead_letter(method, args, kwargs, response=response, exception=exception, attempts=attempt)
+        except Exception:
+            pass
 
     def sync_flush(self):
+        """
+        Send everything queued, and the retries that are due, from the
+        calling thread.
+        """
         session = requests.Session()
-        while self.queue:
-            method, args, kwargs = self.queue.pop()
-            getattr(session, method)(*args, **kwargs)
-            self.total_sent += 1
+        while True:
+            with self.flush_lock:
+                if self.retries and self.retries[0][0] <= time.time():
+                    request = self.pop_retry()
+                elif self.queue:
+                    request = self.queue.pop()
+                else:
+                    break
+            self.send(session, request)
+
+    def close(self, timeout=None):
+        """
+        Let the workers drain the queue and exit. Registered with `atexit`
+        so queued hooks are still sent when the process shuts down.
+        """
+        with self.flush_lock:
+            self.closing = True
+            self.has_work.notify_all()
+            threads = list(self.flush_threads)
+        for thread in threads:
+            thread.join(timeout)
+
+    def oldest_age(self):
+        """
+        Seconds the oldest queued request has been waiting, or 0 if idle.
+        """
+        try:
+            enqueued_at = self.queue[0][3]
+        except IndexError:
+            return 0.0
+        return max(time.time() - enqueued_at, 0.0)
+
+    def get_stats(self):
+        """
+        Cheap point-in-time view of the client, suitable for health checks.
+        """
+        data = self.stats.snapshot()
+        data['queue_depth'] = len(self.queue)
+        data['retry_depth'] = len(self.retries)
+        data['retry_bytes'] = self.retry_bytes
+        data['oldest_age'] = self.oldest_age()
+        return data
@@ -0,0 +1,172 @@
+import ast
+import operator
+import threading
+
+
+MAX_CACHED_CONDITIONS = 10000
+
+# keeps parsing, compiling and evaluating well clear of the recursion limit
+MAX_CONDITION_LENGTH = 2000
+MAX_CONDITION_DEPTH = 32
+
+COMPARISONS = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.In: lambda a, b: a in b,
+    ast.NotIn: lambda a, b: a not in b,
+}
+
+LITERAL_NAMES = {
+    'True': True, 'true': True,
+    'False': False, 'false': False,
+    'None': None, 'null': None,
+}
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def resolve(subject, path):
+    """
+    Follow a dotted key path through dicts; anything missing, or anything
+    that isn't a dict, resolves to None. Attributes are never looked up.
+    """
+    for part in path:
+        if not isinstance(subject, dict):
+            return None
+        subject = subject.get(part)
+    return subject
+
+
+def attribute_path(node):
+    if isinstance(node, ast.Name):
+        return [node.id]
+    if isinstance(node, ast.Attribute):
+        return attribute_path(node.value) + [node.attr]
+    raise ValueError('Unsupported expression in condition.')
+
+
+def literal(node):
+    """
+    The value of a literal node, or raise ValueError.
+    """
+    if isinstance(node, ast.Name) and node.id in LITERAL_NAMES:
+        return LITERAL_NAMES[node.id]
+    if isinstance(node, (ast.List, ast.Tuple, ast.Set)):
+        return tuple(literal(element) for element in node.elts)
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+        return -literal(node.operand)
+    if isinstance(node, (ast.Name, ast.Attribute)):
+        raise ValueError('Not a literal.')
+    return ast.literal_eval(node)
+
+
+def check_depth(tree):
+    """
+    Raise ValueError if the expression nests deeper than
+    `MAX_CONDITION_DEPTH`, without recursing itself.
+    """
+    stack = [(tree, 1)]
+    while stack:
+        node, depth = stack.pop()
+        if depth > MAX_CONDITION_DEPTH:
+            raise ValueError('Condition is nested too deeply.')
+        stack.extend((child, depth + 1) for child in ast.iter_child_nodes(node))
+
+
+def compile_node(node):
+    if isinstance(node, ast.BoolOp):
+        operands = [compile_node(value) for value in node.values]
+        if isinstance(node.op, ast.And):
+            return lambda subject: all(operand(subject) for operand in operands)
+        return lambda subject: any(operand(subject) for operand in operands)
+
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+        operand = compile_node(node.operand)
+        return lambda subject: not operand(subject)
+
+    if isinstance(node, ast.Compare):
+        left = compile_node(node.left)
+        comparisons = []
+        for op, comparator in zip(node.ops, node.comparators):
+            if type(op) not in COMPARISONS:
+                raise ValueError('Unsupported comparison in condition.')
+            comparisons.append((COMPARISONS[type(op)], compile_node(comparator)))
+
+        def compare(subject):
+            value = left(subject)
+            for compare_op, right in comparisons:
+                other = right(subject)
+                try:
+                    if not compare_op(value, other):
+                        return False
+                except TypeError:
+                    return False
+                value = other
+            return True
+        return compare
+
+    try:
+        value = literal(node)
+    except ValueError:
+        pass
+    else:
+        return lambda subject: value
+
+    path = attribute_path(node)
+    if any(part.startswith('_') for part in path):
+        raise ValueError('Private attributes are not allowed in conditions.')
+    return lambda subject: resolve(subject, path)
+
+
+def compile_condition(expression):
+    """
+    Compile a hook condition to a `predicate(subject)` callable.
+
+    Conditions are Python-like boolean expressions over the keys of a dict
+    (the payload fields of an instance, or raw event data), e.g.
+    `status == 'paid' and total >= 100` or `customer.country in ['DE', 'FR']`.
+    Only comparisons, `and`/`or`/`not` and literals are allowed, nothing is
+    ever evaluated. Raises ValueError for anything else, and for conditions
+    longer than `MAX_CONDITION_LENGTH` or nested deeper than
+    `MAX_CONDITION_DEPTH`.
+    """
+    expression = expression.strip()
+    if len(expression) > MAX_CONDITION_LENGTH:
+        raise ValueError('Condition is longer than {0} characters.'.format(MAX_CONDITION_LENGTH))
+    try:
+        tree = ast.parse(expression, mode='eval')
+        check_depth(tree.body)
+        return compile_node(tree.body)
+    except SyntaxError as e:
+        raise ValueError('Invalid condition: {0}'.format(e))
+    except (RuntimeError, MemoryError):
+        # RecursionError is a RuntimeError, the parser may still hit it
+        raise ValueError('Condition is nested too deeply.')
+
+
+def get_condition(hook):
+    """
+    The compiled condition of a hook, cached by hook id.
+    """
+    entry = _cache.get(hook.pk)
+    if entry is not None and entry[0] == hook.condition:
+        return entry[1]
+    predicate = compile_condition(hook.condition)
+    with _cache_lock:
+        if len(_cache) >= MAX_CACHED_CONDITIONS:
+            _cache.clear()
+        _cache[hook.pk] = (hook.condition, predicate)
+    return predicate
+
+
+def clear_cache(hook_id=None):
+    with _cache_lock:
+        if hook_id is None:
+            _cache.clear()
+        else:
+            _cache.pop(hook_id, None)
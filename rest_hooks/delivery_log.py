@@ -0,0 +1,144 @@
+import atexit
+import threading
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections, router, transaction
+from django.utils import timezone
+
+from rest_hooks.utils import get_log_database
+
+
+def is_enabled():
+    return bool(getattr(settings, 'HOOK_DELIVERY_LOG', False))
+
+
+def get_database():
+    """
+    Where the log is written: `settings.HOOK_LOG_DATABASE`, else wherever
+    the routers send `DeliveryLog` writes.
+    """
+    alias = get_log_database()
+    if alias is None:
+        from rest_hooks.models import DeliveryLog
+        alias = router.db_for_write(DeliveryLog) or DEFAULT_DB_ALIAS
+    return alias
+
+
+def get_context(hook):
+    """
+    What a delivery log row needs to know about the hook, captured when
+    the delivery is queued.
+    """
+    return {'hook_id': hook.pk, 'event': hook.event, 'target': hook.target}
+
+
+def describe(response=None, exception=None):
+    """
+    The `(status, response)` columns of a delivery: the status code and the
+    truncated response body, or the error if there was no response.
+    """
+    size = getattr(settings, 'HOOK_DELIVERY_LOG_RESPONSE_SIZE', 1024)
+    if exception is not None:
+        return None, repr(exception)[:size]
+    status = getattr(response, 'status_code', None)
+    try:
+        text = response.text[:size]
+    except Exception:
+        text = ''
+    return (status if isinstance(status, int) else None), text
+
+
+class DeliveryLogBuffer(object):
+    """
+    Collects delivery log rows from any thread and writes them with one
+    `bulk_create` per `HOOK_DELIVERY_LOG_BATCH_SIZE` rows, or on the first
+    delivery after `HOOK_DELIVERY_LOG_FLUSH_INTERVAL` seconds.
+
+    Subclasses buffer other logs by overriding the settings names,
+    `get_model()` and `get_database()`.
+    """
+    batch_size_setting = 'HOOK_DELIVERY_LOG_BATCH_SIZE'
+    flush_interval_setting = 'HOOK_DELIVERY_LOG_FLUSH_INTERVAL'
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = []
+        self.last_flush = time.time()
+
+    def add(self, entry):
+        """
+        Buffer a row, returns True when it's time to flush.
+        """
+        batch_size = getattr(settings, self.batch_size_setting, 100)
+        interval = getattr(settings, self.flush_interval_setting, 5.0)
+        with self.lock:
+            self.entries.append(entry)
+            return len(self.entries) >= batch_size or time.time() - self.last_flush >= interval
+
+    def flush(self):
+        with self.lock:
+            entries, self.entries = self.entries, []
+            self.last_flush = time.time()
+        if not entries:
+            return 0
+        model = self.get_model()
+        using = self.get_database()
+        # synchronous deliveries flush on the caller's connection, maybe in
+        # its transaction: a failed write only rolls back to this savepoint
+        with transaction.atomic(using=using):
+            model.objects.db_manager(using).bulk_create([model(**entry) for entry in entries])
+        return len(entries)
+
+    def get_model(self):
+        from rest_hooks.models import DeliveryLog
+        return DeliveryLog
+
+    def get_database(self):
+        return get_database()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+_buffer = DeliveryLogBuffer()
+
+
+def record(context, response=None, exception=None, latency=None, attempt=1, close_connection=False):
+    """
+    Log the outcome of one delivery attempt of the hook described by
+    `context` (see `get_context`).
+    """
+    if context is None or not is_enabled():
+        return
+    status, text = describe(response, exception)
+    entry = dict(context, status=status, latency=latency, attempt=attempt, response=text, created=timezone.now())
+    if _buffer.add(entry):
+        flush(close_connection=close_connection)
+
+
+def flush(close_connection=False):
+    """
+    Write the buffered rows now. Returns the number of rows written.
+    """
+    try:
+        return _buffer.flush()
+    except DatabaseError:
+        # the log must never break delivery, the batch is dropped
+        return 0
+    finally:
+        if close_connection:
+            connections[get_database()].close()
+
+
+def client_result(context, response=None, exception=None, latency=None, attempt=1):
+    """
+    `on_result` callback of the threaded `Client`. It runs in the worker
+    threads, which close their database connection after each write.
+    """
+    record(context, response=response, exception=exception, latency=latency, attempt=attempt,
+           close_connection=True)
+
+
+# rows still buffered when the process exits
+atexit.register(flush)
@@ -0,0 +1,73 @@
+import glob
+import os
+import pstats
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from rest_hooks import profiling
+
+
+class Command(BaseCommand):
+    help = (
+        'Print the slowest stages of hook dispatch recorded with HOOK_PROFILE, '
+        'and the top functions of sampled cProfile dumps in HOOK_PROFILE_DIR.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--by', choices=['event', 'model'], default='event',
+                            help='Group timings by event name or by model label.')
+        parser.add_argument('--limit', type=int, default=10,
+                            help='Number of rows to print.')
+        parser.add_argument('--dumps', action='store_true',
+                            help='Also aggregate the cProfile dumps in HOOK_PROFILE_DIR.')
+        parser.add_argument('--clear', action='store_true',
+                            help='Remove the recorded timings and the dumps after printing.')
+
+    def handle(self, *args, **options):
+        if not profiling.is_enabled():
+            raise CommandError('Set HOOK_PROFILE = True to record dispatch timings.')
+
+        self.print_timings(options['by'], options['limit'])
+        if options['dumps']:
+            self.print_dumps(options['limit'], options['clear'])
+        if options['clear']:
+            profiling.clear()
+
+    def print_timings(self, by, limit):
+        rows = profiling.summarize(by=by, limit=limit)
+        if not rows:
+            if getattr(settings, 'HOOK_PROFILE_DIR', None):
+                self.stdout.write('No dispatch timings recorded.')
+            else:
+                self.stdout.write('No dispatch timings recorded in this process, '
+                                  'set HOOK_PROFILE_DIR to collect those of other processes.')
+            return
+        self.stdout.write('{0:<10} {1:<40} {2:>8} {3:>12} {4:>12} {5:>12}'.format(
+            'stage', by, 'count', 'total ms', 'mean ms', 'max ms'))
+        for row in rows:
+            self.stdout.write('{0:<10} {1:<40} {2:>8} {3:>12.3f} {4:>12.3f} {5:>12.3f}'.format(
+                row['stage'], str(row['key']), row['count'],
+                row['total'] * 1000, row['mean'] * 1000, row['max'] * 1000))
+
+    def print_dumps(self, limit, clear):
+        profile_dir = getattr(settings, 'HOOK_PROFILE_DIR', None)
+        if not profile_dir:
+            raise CommandError('HOOK_PROFILE_DIR is not set.')
+        filenames = sorted(glob.glob(os.path.join(profile_dir, 'rest_hooks-*.prof')))
+        if not filenames:
+            self.stdout.write('No cProfile dumps found in {0}.'.format(profile_dir))
+            return
+        self.stdout.write('\n{0} sampled dispatches:'.format(len(filenames)))
+        stream = StringIO()
+        stats = pstats.Stats(*filenames, stream=stream)
+        stats.sort_stats('cumulative').print_stats(limit)
+        self.stdout.write(stream.getvalue())
+        if clear:
+            for filename in filenames:
+                os.remove(filename)
@@ -0,0 +1,296 @@
+import json
+import random
+import threading
+import time
+import uuid
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from rest_hooks import models as hook_models
+from rest_hooks.models import get_event_config
+from rest_hooks import profiling
+from rest_hooks.payloads import PreEncodedPayload
+from rest_hooks.utils import distill_model_event, get_hook_model
+
+try:
+    from django.contrib.auth import get_user_model
+except ImportError:
+    get_user_model = None
+
+
+BACKENDS = ('session', 'client', 'celery')
+
+
+def percentile(values, percent):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = int(round(percent / 100.0 * (len(values) - 1)))
+    return values[index]
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StubSubscriber(object):
+    """
+    A local subscriber endpoint with configurable misbehaviour.
+
+    Every delivery is answered after `latency` seconds with a 500, 410 or
+    429 at the given rates (200 otherwise). With `slow_read` set the request
+    body is read in small chunks spread over that many seconds, like a
+    congested subscriber would.
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, gone_rate=0.0, throttle_rate=0.0, slow_read=0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.gone_rate = gone_rate
+        self.throttle_rate = throttle_rate
+        self.slow_read = slow_read
+        self.lock = threading.Lock()
+        self.received = []
+        self.server = None
+
+    def choose_status(self):
+        roll = random.random()
+        for status, rate in ((500, self.error_rate), (410, self.gone_rate), (429, self.throttle_rate)):
+            if roll < rate:
+                return status
+            roll -= rate
+        return 200
+
+    def read_body(self, request):
+        length = int(request.headers.get('Content-Length') or 0)
+        if not self.slow_read:
+            return request.rfile.read(length)
+        chunks = []
+        chunk_size = max(length // 8, 1)
+        while length > 0:
+            chunks.append(request.rfile.read(min(chunk_size, length)))
+            length -= chunk_size
+            time.sleep(self.slow_read / 8.0)
+        return b''.join(chunks)
+
+    def handle(self, request):
+        body = self.read_body(request)
+        if self.latency:
+            time.sleep(self.latency)
+        status = self.choose_status()
+
+        request.send_response(status)
+        if status == 429:
+            request.send_header('Retry-After', '1')
+        request.send_header('Content-Length', '0')
+        request.end_headers()
+
+        try:
+            sent_at = json.loads(body.decode('utf-8'))['data']['sent_at']
+        except (ValueError, KeyError, TypeError):
+            sent_at = None
+        with self.lock:
+            self.received.append((time.time(), status, sent_at))
+
+    def start(self):
+        subscriber = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                subscriber.handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0}/'.format(self.server.server_address[1])
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset(self):
+        with self.lock:
+            self.received = []
+
+    def count(self):
+        with self.lock:
+            return len(self.received)
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive events through distill_model_event into a local stub subscriber '
+        'and report delivery latency and throughput per delivery backend.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--event', help='Event name from HOOK_EVENTS (defaults to the first custom event).')
+        parser.add_argument('--hooks', type=int, default=10, help='Number of subscribed hooks.')
+        parser.add_argument('--rate', type=float, default=10, help='Events fired per second.')
+        parser.add_argument('--duration', type=float, default=5, help='Seconds to fire events for.')
+        parser.add_argument('--payload-size', type=int, default=1024, help='Bytes of padding in each payload.')
+        parser.add_argument('--backend', action='append', choices=BACKENDS,
+                            help='Delivery backend to test, may be repeated (default: session and client).')
+        parser.add_argument('--latency', type=float, default=0.0, help='Stub response latency in seconds.')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of 500 responses.')
+        parser.add_argument('--gone-rate', type=float, default=0.0, help='Fraction of 410 responses.')
+        parser.add_argument('--throttle-rate', type=float, default=0.0, help='Fraction of 429 responses.')
+        parser.add_argument('--slow-read', type=float, default=0.0,
+                            help='Seconds the stub takes to read each request body.')
+        parser.add_argument('--timeout', type=float, default=30, help='Seconds to wait for queued deliveries.')
+
+    def handle(self, *args, **options):
+        event_name = options['event'] or self.default_event()
+        if event_name not in settings.HOOK_EVENTS:
+            raise CommandError('"{0}" does not exist in `settings.HOOK_EVENTS`.'.format(event_name))
+
+        backends = [
+            (backend, self.get_backend(backend))
+            for backend in options['backend'] or ['session', 'client']
+        ]
+
+        stub = StubSubscriber(
+            latency=options['latency'],
+            error_rate=options['error_rate'],
+            gone_rate=options['gone_rate'],
+            throttle_rate=options['throttle_rate'],
+            slow_read=options['slow_read'],
+        )
+        stub.start()
+        user = self.create_user()
+        HookModel = get_hook_model()
+        try:
+            HookModel.objects.bulk_subscribe([
+                {'user': user, 'event': event_name, 'target': '{0}{1}'.format(stub.url, n)}
+                for n in range(options['hooks'])
+            ])
+            for backend, (build, overrides) in backends:
+                stub.reset()
+                result = self.run_backend(build, overrides, event_name, user, stub, options)
+                self.report(backend, result)
+        finally:
+            HookModel.objects.bulk_unsubscribe(user=user)
+            user.delete()
+            stub.stop()
+
+        if profiling.is_enabled():
+            self.stdout.write('\nSlowest dispatch stages (HOOK_PROFILE):')
+            for row in profiling.summarize(limit=10):
+                self.stdout.write('  {0:<10} {1:<30} mean {2:8.3f} ms  max {3:8.3f} ms'.format(
+                    row['stage'], str(row['key']), row['mean'] * 1000, row['max'] * 1000))
+
+    def default_event(self):
+        for event_name in sorted(settings.HOOK_EVENTS.keys()):
+            if not get_event_config(event_name).get('action'):
+                return event_name
+        raise CommandError('Pass --event, there is no custom event in `settings.HOOK_EVENTS`.')
+
+    def create_user(self):
+        if get_user_model is not None:
+            User = get_user_model()
+        else:
+            from django.contrib.auth.models import User
+        username = 'rest_hooks_loadtest_{0}'.format(uuid.uuid4().hex[:8])
+        return User.objects.create(**{User.USERNAME_FIELD: username})
+
+    def get_backend(self, backend):
+        """
+        Returns a (client factory, settings overrides) pair for the backend.
+
+        The client replaces `rest_hooks.models.client` for the run, which
+        only the default transport posts with, so that one is forced.
+        """
+        overrides = {'HOOK_DELIVERER': None, 'HOOK_TRANSPORT': 'rest_hooks.transports.DefaultTransport'}
+        if backend == 'session':
+            import requests
+            return requests.Session, overrides
+        if backend == 'client':
+            # the pool and retry settings being tuned
+            return hook_models.build_client, dict(overrides, HOOK_THREADING=True)
+        try:
+            from rest_hooks.tasks import DeliverHook
+        except ImportError:
+            raise CommandError('The celery backend requires celery to be installed.')
+        DeliverHook.app.conf.update(task_always_eager=True, CELERY_ALWAYS_EAGER=True)
+        return (lambda: hook_models.client), dict(overrides, HOOK_DELIVERER='rest_hooks.tasks.deliver_hook_wrapper')
+
+    def run_backend(self, build, overrides, event_name, user, stub, options):
+        total = int(options['rate'] * options['duration'])
+        expected = total * options['hooks']
+        padding = 'x' * options['payload_size']
+        dispatch_times = []
+
+        original_client = hook_models.client
+        try:
+            with override_settings(**overrides):
+                client = hook_models.client = build()
+                started = time.time()
+                for seq in range(total):
+                    delay = started + seq / options['rate'] - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+                    sent_at = time.time()
+                    distill_model_event(
+                        None,
+                        event_name=event_name,
+                        user_override=user,
+                        trust_event_name=True,
+                        payload_override=PreEncodedPayload(
+                            {'seq': seq, 'sent_at': sent_at, 'padding': padding}
+                        ),
+                    )
+                    dispatch_times.append(time.time() - sent_at)
+
+                deadline = time.time() + options['timeout']
+                while stub.count() < expected and time.time() < deadline:
+                    time.sleep(0.05)
+                if client is not original_client:
+                    client.close()
+        finally:
+            hook_models.client = original_client
+
+        with stub.lock:
+            received = list(stub.received)
+        return {
+            'events': total,
+            'expected': expected,
+            'received': received,
+            'started': started,
+            'dispatch_times': dispatch_times,
+        }
+
+    def report(self, backend, result):
+        received = result['received']
+        latencies = [at - sent_at for at, status, sent_at in received if sent_at is not None]
+        statuses = {}
+        for at, status, sent_at in received:
+            statuses[status] = statuses.get(status, 0) + 1
+        elapsed = (max(at for at, status, sent_at in received) - result['started']) if received else 0
+
+        self.stdout.write('\n{0}'.format(backend))
+        self.stdout.write('  events fired:      {0}'.format(result['events']))
+        self.stdout.write('  deliveries:        {0} / {1}'.format(len(received), result['expected']))
+        self.stdout.write('  statuses:          {0}'.format(
+            ', '.join('{0}: {1}'.format(status, count) for status, count in sorted(statuses.items())) or '-'))
+        self.stdout.write('  throughput:        {0:.1f} deliveries/s'.format(
+            len(received) / elapsed if elapsed else 0.0))
+        self.stdout.write('  latency ms:        p50 {0:.1f}  p90 {1:.1f}  p99 {2:.1f}  max {3:.1f}'.format(
+            *[percentile(latencies, p) * 1000 for p in (50, 90, 99, 100)]))
+        self.stdout.write('  dispatch ms/event: p50 {0:.2f}  p99 {1:.2f}'.format(
+            *[percentile(result['dispatch_times'], p) * 1000 for p in (50, 99)]))
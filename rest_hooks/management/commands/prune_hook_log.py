@@ -0,0 +1,38 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from rest_hooks.models import DeliveryLog, EventLog
+from rest_hooks.utils import delete_in_chunks, get_log_database
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete delivery log and event log rows older than --days, in small '
+        'chunks by primary key so the tables are never locked for long.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int,
+                            default=getattr(settings, 'HOOK_DELIVERY_LOG_RETENTION_DAYS', 30),
+                            help='Keep this many days of logs (default: HOOK_DELIVERY_LOG_RETENTION_DAYS or 30).')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Rows deleted per statement.')
+        parser.add_argument('--sleep', type=float, default=0,
+                            help='Seconds to pause between chunks.')
+
+    def handle(self, *args, **options):
+        if options['days'] < 0 or options['chunk_size'] < 1:
+            raise CommandError('--days must not be negative and --chunk-size must be positive.')
+
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        for model, name in ((DeliveryLog, 'delivery log'), (EventLog, 'event log')):
+            deleted = delete_in_chunks(
+                model.objects.filter(created__lt=cutoff),
+                chunk_size=options['chunk_size'],
+                sleep=options['sleep'],
+                using=get_log_database(),
+            )
+            self.stdout.write('Deleted {0} {1} rows older than {2}.'.format(deleted, name, cutoff))
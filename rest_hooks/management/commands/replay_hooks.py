@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from rest_hooks.replay import replay
+from rest_hooks.utils import get_hook_model
+
+
+def parse_time(value):
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise CommandError('"{0}" is not a valid date and time, use YYYY-MM-DD HH:MM[:SS].'.format(value))
+    if getattr(settings, 'USE_TZ', False) and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, timezone.get_current_timezone())
+    return parsed
+
+
+class Command(BaseCommand):
+    help = (
+        'Redeliver the events recorded with HOOK_EVENT_LOG to a single hook, '
+        'e.g. after its subscriber was down. Prints a cursor after every '
+        'batch, pass it to --cursor to resume.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hook', type=int, required=True, help='Id of the hook to redeliver to.')
+        parser.add_argument('--since', help='Replay events from this time on (YYYY-MM-DD HH:MM).')
+        parser.add_argument('--until', help='Replay events before this time.')
+        parser.add_argument('--cursor', type=int, help='Resume after this event log id.')
+        parser.add_argument('--batch-size', type=int, default=500, help='Events loaded per batch.')
+
+    def handle(self, *args, **options):
+        HookModel = get_hook_model()
+        try:
+            hook = HookModel.objects.get(pk=options['hook'])
+        except HookModel.DoesNotExist:
+            raise CommandError('Hook {0} does not exist.'.format(options['hook']))
+
+        since = parse_time(options['since']) if options['since'] else None
+        until = parse_time(options['until']) if options['until'] else None
+
+        total = 0
+        for cursor, delivered in replay(hook, since=since, until=until, cursor=options['cursor'],
+                                        batch_size=options['batch_size']):
+            total += delivered
+            self.stdout.write('Redelivered {0} events, cursor {1}'.format(delivered, cursor))
+        self.stdout.write('Redelivered {0} events to {1}.'.format(total, hook.target))
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def merge_duplicate_hooks(apps, schema_editor):
+    """
+    Keep the oldest hook of every (user, event, target) and drop the copies
+    so that the unique constraint can be added.
+    """
+    Hook = apps.get_model('rest_hooks', 'Hook')
+    if Hook._meta.swapped:
+        return
+    hooks = Hook.objects.using(schema_editor.connection.alias)
+
+    duplicates = (
+        hooks.values('user', 'event', 'target')
+        .annotate(keep_id=Min('id'), copies=Count('id'))
+        .filter(copies__gt=1)
+        .order_by()
+    )
+    for duplicate in list(duplicates):
+        hooks.filter(
+            user=duplicate['user'],
+            event=duplicate['event'],
+            target=duplicate['target'],
+        ).exclude(id=duplicate['keep_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('rest_hooks', '0002_swappable_hook_model'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_hooks, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='hook',
+            unique_together=set([('user', 'event', 'target')]),
+        ),
+    ]
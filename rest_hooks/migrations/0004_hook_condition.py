@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest_hooks', '0003_unique_hook_subscription'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hook',
+            name='condition',
+            field=models.TextField(blank=True, default='', verbose_name='Condition'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest_hooks', '0004_hook_condition'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hook',
+            name='payload_fields',
+            field=models.CharField(blank=True, default='', max_length=255, verbose_name='Payload fields'),
+        ),
+    ]
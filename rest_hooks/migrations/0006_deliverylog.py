@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest_hooks', '0005_hook_payload_fields'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeliveryLog',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now, db_index=True)),
+                ('hook_id', models.PositiveIntegerField()),
+                ('event', models.CharField(max_length=64, verbose_name='Event')),
+                ('target', models.URLField(max_length=255, verbose_name='Target URL')),
+                ('status', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('latency', models.FloatField(blank=True, null=True)),
+                ('attempt', models.PositiveSmallIntegerField(default=1)),
+                ('response', models.TextField(blank=True, default='')),
+            ],
+            options={
+                'index_together': {('hook_id', 'created')},
+            },
+        ),
+    ]
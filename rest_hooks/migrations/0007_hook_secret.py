@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest_hooks', '0006_deliverylog'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hook',
+            name='secret',
+            field=models.CharField(blank=True, default='', max_length=128, verbose_name='Secret'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest_hooks', '0007_hook_secret'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hook',
+            name='is_active',
+            field=models.BooleanField(default=True, verbose_name='Active'),
+        ),
+    ]
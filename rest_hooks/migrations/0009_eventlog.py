@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest_hooks', '0008_hook_is_active'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventLog',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now, db_index=True)),
+                ('event', models.CharField(max_length=64, verbose_name='Event')),
+                ('model_label', models.CharField(max_length=100)),
+                ('object_pk', models.CharField(max_length=64)),
+                ('action', models.CharField(blank=True, default='', max_length=64)),
+                ('user_pk', models.CharField(blank=True, default='', max_length=64)),
+            ],
+            options={
+                'index_together': {('event', 'created')},
+            },
+        ),
+    ]
@@ -1,31 +1,28 @@
-from collections import OrderedDict
-
-import requests
+import time
 
 import django
 from django.conf import settings
-from django.core import serializers
 from django.core.exceptions import ValidationError, ImproperlyConfigured
-from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from django.db.models.signals import post_save, post_delete
 from django.test.signals import setting_changed
 from django.dispatch import receiver
-
-try:
-    # Django <= 1.6 backwards compatibility
-    from django.utils import simplejson as json
-except ImportError:
-    # Django >= 1.7
-    import json
-
-from rest_hooks.signals import hook_event, raw_hook_event, hook_sent_event
-from rest_hooks.utils import distill_model_event, get_hook_model, get_module, find_and_fire_hook
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+
+from rest_hooks import delivery_log, profiling, signing
+from rest_hooks.conditions import compile_condition, get_condition, clear_cache as clear_condition_cache
+from rest_hooks.payloads import PreEncodedPayload, encode_payload
+from rest_hooks.serializers import condition_values, serialize_instance
+from rest_hooks.signals import (
+    hook_event, raw_hook_event, hook_sent_event, hooks_bulk_changed, hook_delivery_failed
+)
+from rest_hooks.transports import Delivery, get_transport, reset_transport
+from rest_hooks.utils import (
+    delete_in_chunks, distill_model_event, get_hook_model, get_module, find_and_fire_hook, subscriptions_changed
+)
 
 
-if getattr(settings, 'HOOK_CUSTOM_MODEL', None) is None:
-    settings.HOOK_CUSTOM_MODEL = 'rest_hooks.Hook'
-
 HOOK_EVENTS = getattr(settings, 'HOOK_EVENTS', None)
 if HOOK_EVENTS is None:
     raise Exception('You need to define settings.HOOK_EVENTS!')
@@ -33,11 +30,30 @@ if HOOK_EVENTS is None:
 _HOOK_EVENT_ACTIONS_CONFIG = None
 
 
+def get_event_config(event_name):
+    """
+    The settings.HOOK_EVENTS entry of an event as a dict.
+
+    Entries are either the 'app_label.Model.action' string (or None for
+    custom events), or a dict with that string as `action` plus options:
+
+        'book.added': {
+            'action': 'bookstore.Book.created',
+            'fields': ['title', 'pages'],
+        }
+    """
+    config = HOOK_EVENTS.get(event_name)
+    if isinstance(config, dict):
+        return config
+    return {'action': config}
+
+
 def get_event_actions_config():
     global _HOOK_EVENT_ACTIONS_CONFIG
     if _HOOK_EVENT_ACTIONS_CONFIG is None:
         _HOOK_EVENT_ACTIONS_CONFIG = {}
-        for event_name, auto in HOOK_EVENTS.items():
+        for event_name in HOOK_EVENTS.keys():
+            auto = get_event_config(event_name).get('action')
             if not auto:
                 continue
             model_label, action = auto.rsplit('.', 1)
@@ -57,15 +73,161 @@ def get_event_actions_config():
     return _HOOK_EVENT_ACTIONS_CONFIG
 
 
-if getattr(settings, 'HOOK_THREADING', True):
-    from rest_hooks.client import Client
-    client = Client()
-else:
-    client = requests.Session()
+def send_dead_letter(method, args, kwargs, response=None, exception=None, attempts=1):
+    """
+    Dead-letter callback of the threaded client: a request failed for good.
+    """
+    hook_delivery_failed.send_robust(
+        sender=None,
+        method=method,
+        url=kwargs.get('url'),
+        data=kwargs.get('data'),
+        response=response,
+        exception=exception,
+        attempts=attempts,
+    )
+
+
+def build_client_options():
+    """
+    The `Client` keyword arguments configured in settings.
+    """
+    return {
+        'min_threads': getattr(settings, 'HOOK_THREADING_MIN_THREADS', 0),
+        'max_threads': getattr(settings, 'HOOK_THREADING_MAX_THREADS', 3),
+        'idle_timeout': getattr(settings, 'HOOK_THREADING_IDLE_TIMEOUT', 1.0),
+        'max_backlog': getattr(settings, 'HOOK_THREADING_MAX_BACKLOG', 0.5),
+        'max_attempts': getattr(settings, 'HOOK_RETRY_MAX_ATTEMPTS', 1),
+        'retry_base_delay': getattr(settings, 'HOOK_RETRY_BASE_DELAY', 1.0),
+        'retry_max_delay': getattr(settings, 'HOOK_RETRY_MAX_DELAY', 60.0),
+        'max_pending_retries': getattr(settings, 'HOOK_RETRY_MAX_PENDING', 10000),
+        'max_pending_retry_bytes': getattr(settings, 'HOOK_RETRY_MAX_PENDING_BYTES', 50 * 1024 * 1024),
+        'dead_letter': send_dead_letter,
+        'on_result': delivery_log.client_result,
+    }
+
+
+def build_client():
+    """
+    Build the delivery client: a threaded `Client` unless
+    `settings.HOOK_THREADING` is False, then a plain `requests.Session`.
+    """
+    if getattr(settings, 'HOOK_THREADING', True):
+        from rest_hooks.client import Client
+        return Client(**build_client_options())
+    import requests
+    return requests.Session()
+
+
+# built on first delivery, so processes that never fire a hook don't pay for it
+client = SimpleLazyObject(build_client)
+
+
+def get_delivery_stats():
+    """
+    Return a snapshot of the threaded client's delivery stats (counters,
+    queue depth, active workers and age of the oldest queued request), or
+    `None` if `settings.HOOK_THREADING` is disabled.
+    """
+    get_stats = getattr(client, 'get_stats', None)
+    if get_stats is None:
+        return None
+    return get_stats()
+
 
 AUTH_USER_MODEL = getattr(settings, 'AUTH_USER_MODEL', 'auth.User')
 
 
+class HookManager(models.Manager):
+    """
+    Batched subscription management for hook models.
+    """
+
+    def validate_events(self, events):
+        """ Validate a set of event names against settings.HOOK_EVENTS at once. """
+        invalid = set(events) - set(HOOK_EVENTS.keys())
+        if invalid:
+            raise ValidationError(
+                "Invalid hook event {evt}.".format(evt=', '.join(sorted(invalid)))
+            )
+
+    def validate_conditions(self, conditions):
+        """ Compile every distinct condition once. """
+        for condition in conditions:
+            try:
+                compile_condition(condition)
+            except ValueError as e:
+                raise ValidationError(str(e))
+
+    def subscribe(self, user, event, target, **defaults):
+        """
+        Idempotently subscribe `target` to `event` for `user`.
+
+        Retried subscribe calls return the existing hook instead of creating
+        a duplicate. Returns a `(hook, created)` tuple.
+        """
+        self.validate_events([event])
+        self.validate_conditions([defaults['condition']] if defaults.get('condition') else [])
+        return self.get_or_create(user=user, event=event, target=target, defaults=defaults)
+
+    def bulk_subscribe(self, subscriptions, batch_size=500, ignore_conflicts=False):
+        """
+        Create many hooks with batched INSERTs.
+
+        Args:
+            subscriptions: iterable of unsaved hook instances or dicts of
+                field values, e.g. `{'user': user, 'event': 'book.added',
+                'target': 'http://example.com/'}`.
+            batch_size: number of rows per INSERT.
+            ignore_conflicts: skip rows violating a database constraint
+                (requires Django 2.2+).
+
+        Events are validated once for the whole batch instead of calling
+        `clean()` on every hook, and repeated (user, event, target) entries
+        within the batch are collapsed. Returns the list of hooks passed to
+        `bulk_create`.
+        """
+        hooks = []
+        seen = set()
+        for subscription in subscriptions:
+            if not isinstance(subscription, self.model):
+                subscription = self.model(**subscription)
+            key = (subscription.user_id, subscription.event, subscription.target)
+            if key in seen:
+                continue
+            seen.add(key)
+            hooks.append(subscription)
+        if not hooks:
+            return []
+        self.validate_events(set(hook.event for hook in hooks))
+        self.validate_conditions(set(hook.condition for hook in hooks if hook.condition))
+
+        kwargs = {'batch_size': batch_size}
+        if ignore_conflicts:
+            kwargs['ignore_conflicts'] = True
+        hooks = self.bulk_create(hooks, **kwargs)
+
+        hooks_bulk_changed.send(sender=self.model, action='subscribe')
+        return hooks
+
+    def bulk_unsubscribe(self, chunk_size=1000, **filters):
+        """
+        Delete every hook matching `filters`, `chunk_size` rows at a time so
+        that no single statement holds locks on the whole table. Hooks are
+        deleted without loading them, so no `post_delete` is sent per hook,
+        only `hooks_bulk_changed` once at the end.
+
+            Hook.objects.bulk_unsubscribe(user=user)
+            Hook.objects.bulk_unsubscribe(event='book.added', target__startswith='http://old.example.com/')
+
+        Returns the number of deleted hooks.
+        """
+        deleted = delete_in_chunks(self.filter(**filters), chunk_size=chunk_size, raw=True)
+        if deleted:
+            hooks_bulk_changed.send(sender=self.model, action='unsubscribe')
+        return deleted
+
+
 class AbstractHook(models.Model):
     """
     Stores a representation of a Hook.
@@ -76,16 +238,48 @@ class AbstractHook(models.Model):
     user = models.ForeignKey(AUTH_USER_MODEL, related_name='%(class)ss', on_delete=models.CASCADE)
     event = models.CharField('Event', max_length=64, db_index=True)
     target = models.URLField('Target URL', max_length=255)
+    condition = models.TextField('Condition', blank=True, default='')
+    payload_fields = models.CharField('Payload fields', max_length=255, blank=True, default='')
+    secret = models.CharField('Secret', max_length=128, blank=True, default='')
+    is_active = models.BooleanField('Active', default=True)
+
+    objects = HookManager()
 
     class Meta:
         abstract = True
+        unique_together = (('user', 'event', 'target'),)
 
     def clean(self):
-        """ Validation for events. """
+        """ Validation for events and conditions. """
         if self.event not in HOOK_EVENTS.keys():
             raise ValidationError(
                 "Invalid hook event {evt}.".format(evt=self.event)
             )
+        if self.condition:
+            try:
+                compile_condition(self.condition)
+            except ValueError as e:
+                raise ValidationError(str(e))
+
+    def matches(self, subject):
+        """
+        Whether the instance (or raw event data) satisfies this hook's
+        condition. Hooks without a condition match everything.
+
+        On instances conditions only see the fields this hook's payload
+        would contain, so they can't probe anything the subscriber isn't
+        sent anyway.
+        """
+        if not self.condition:
+            return True
+        try:
+            predicate = get_condition(self)
+        except ValueError:
+            # saved without clean(), never deliver on a broken filter
+            return False
+        if isinstance(subject, models.Model):
+            subject = condition_values(subject, self.get_payload_fields())
+        return predicate(subject)
 
     def dict(self):
         return {
@@ -94,6 +288,35 @@ class AbstractHook(models.Model):
             'target': self.target
         }
 
+    def get_payload_fields(self):
+        """
+        The field projection of the default serializer: the hook's own
+        comma separated `payload_fields`, else the `fields` of its event in
+        settings.HOOK_EVENTS. None means all fields.
+
+        Returned as a sorted tuple so hooks asking for the same fields share
+        one serialization.
+        """
+        if self.payload_fields:
+            fields = self.payload_fields.split(',')
+        else:
+            fields = get_event_config(self.event).get('fields')
+        if not fields:
+            return None
+        return tuple(sorted(set(field.strip() for field in fields if field.strip())))
+
+    def uses_default_serializer(self, instance):
+        """
+        Whether `serialize_hook` falls back to the built-in serializer for
+        this instance, which lets callers share its output between hooks.
+        """
+        if callable(getattr(instance, 'serialize_hook', None)):
+            return False
+        if getattr(settings, 'HOOK_SERIALIZER', None):
+            return False
+        method = type(self).serialize_hook
+        return getattr(method, '__func__', method) is _default_serialize_hook
+
     def serialize_hook(self, instance):
         """
         Serialize the object down to Python primitives.
@@ -106,56 +329,156 @@ class AbstractHook(models.Model):
             serializer = get_module(settings.HOOK_SERIALIZER)
             return serializer(instance, hook=self)
         # if no user defined serializers, fallback to the django builtin!
-        data = serializers.serialize('python', [instance])[0]
-        for k, v in data.items():
-            if isinstance(v, OrderedDict):
-                data[k] = dict(v)
-
-        if isinstance(data, OrderedDict):
-            data = dict(data)
-
         return {
             'hook': self.dict(),
-            'data': data,
+            'data': serialize_instance(instance, fields=self.get_payload_fields()),
         }
 
     def deliver_hook(self, instance, payload_override=None):
         """
         Deliver the payload to the target URL.
 
-        By default it serializes to JSON and POSTs.
+        By default it serializes to JSON and POSTs with the transport of
+        `settings.HOOK_TRANSPORT`.
 
         Args:
             instance: instance that triggered event.
             payload_override: JSON-serializable object or callable that will
                 return such object. If callable is used it should accept 2
-                arguments: `hook` and `instance`.
+                arguments: `hook` and `instance`. A `PreEncodedPayload` is
+                sent without re-encoding its data.
         """
+        if getattr(settings, 'HOOK_DELIVERER', None):
+            payload, pre_encoded = self.get_payload(instance, payload_override)
+            deliverer = get_module(settings.HOOK_DELIVERER)
+            started = profiling.start()
+            deliverer(self.target, payload, instance=instance, hook=self)
+            self.delivery_sent(payload, instance, started)
+            return None
+
+        delivery = self.prepare_delivery(instance, payload_override)
+        started = profiling.start()
+        get_transport().send(delivery)
+        self.delivery_sent(delivery.payload, instance, started)
+        return None
+
+    def get_payload(self, instance, payload_override=None):
+        """
+        The payload for `instance`, and the `PreEncodedPayload` it came from
+        if any.
+        """
+        model_label = get_model_label(instance) if profiling.is_enabled() else None
+        pre_encoded = None
+
         if payload_override is None:
-            payload = self.serialize_hook(instance)
+            with profiling.profile('serialize', self.event, model_label):
+                payload = self.serialize_hook(instance)
+        elif isinstance(payload_override, PreEncodedPayload):
+            pre_encoded = payload_override
+            payload = pre_encoded.for_hook(self)
         else:
             payload = payload_override
 
         if callable(payload):
-            payload = payload(self, instance)
+            with profiling.profile('serialize', self.event, model_label):
+                payload = payload(self, instance)
+        return payload, pre_encoded
 
+    def prepare_delivery(self, instance, payload_override=None):
+        """
+        Serialize and encode the payload into a `Delivery` for the transport.
+        """
+        payload, pre_encoded = self.get_payload(instance, payload_override)
+        model_label = get_model_label(instance) if profiling.is_enabled() else None
+        with profiling.profile('encode', self.event, model_label):
+            if pre_encoded is not None:
+                data = pre_encoded.encode_for_hook(self)
+            else:
+                data = encode_payload(payload)
+        return Delivery(self, payload, data, instance=instance, shared=pre_encoded)
+
+    def delivery_sent(self, payload, instance, started=None):
+        hook_sent_event.send_robust(sender=self.__class__, payload=payload, instance=instance, hook=self)
+        if started is not None:
+            profiling.record('deliver', started, self.event, get_model_label(instance))
+
+    def uses_default_delivery(self):
+        """
+        Whether deliveries of this hook can be batched with the transport,
+        i.e. there's no `HOOK_DELIVERER` and `deliver_hook` isn't overridden.
+        """
         if getattr(settings, 'HOOK_DELIVERER', None):
-            deliverer = get_module(settings.HOOK_DELIVERER)
-            deliverer(self.target, payload, instance=instance, hook=self)
-        else:
-            client.post(
-                url=self.target,
-                data=json.dumps(payload, cls=DjangoJSONEncoder),
-                headers={'Content-Type': 'application/json'}
-            )
+            return False
+        method = type(self).deliver_hook
+        return getattr(method, '__func__', method) is _default_deliver_hook
 
-        hook_sent_event.send_robust(sender=self.__class__, payload=payload, instance=instance, hook=self)
-        return None
+    def get_headers(self, body):
+        """
+        The request headers for the encoded `body`, signed with the hook's
+        `secret` if it has one. Useful in custom `HOOK_DELIVERER`s too.
+        """
+        headers = {'Content-Type': 'application/json'}
+        if self.secret:
+            if not isinstance(body, bytes):
+                body = body.encode('utf-8')
+            header = getattr(settings, 'HOOK_SIGNATURE_HEADER', 'X-Hook-Signature')
+            headers[header] = signing.sign(self, body)
+        return headers
+
+    def get_request(self, data):
+        """
+        The keyword arguments of the POST of the encoded payload.
+        """
+        if self.secret and not isinstance(data, bytes):
+            # sign and send the very same bytes
+            data = data.encode('utf-8')
+        return {
+            'url': self.target,
+            'data': data,
+            'headers': self.get_headers(data),
+        }
+
+    def post(self, data, using=None):
+        """
+        POST the encoded payload with the delivery client, or the `using`
+        session.
+        """
+        return self.send_request(self.get_request(data), using=using)
+
+    def send_request(self, request, using=None, close_connection=False):
+        """
+        Send a request built by `get_request`, logging the outcome when
+        `settings.HOOK_DELIVERY_LOG` is enabled. Threads of their own pass
+        `close_connection` to close the database connection after writing it.
+        """
+        sender = client if using is None else using
+        if not delivery_log.is_enabled():
+            return sender.post(**request)
+
+        context = delivery_log.get_context(self)
+        if getattr(sender, 'on_result', None) is not None:
+            # the threaded client logs every attempt once it's been made
+            return sender.post(context=context, **request)
+
+        started = time.time()
+        try:
+            response = sender.post(**request)
+        except Exception as e:
+            delivery_log.record(context, exception=e, latency=time.time() - started,
+                                close_connection=close_connection)
+            raise
+        delivery_log.record(context, response=response, latency=time.time() - started,
+                            close_connection=close_connection)
+        return response
 
     def __unicode__(self):
         return u'{} => {}'.format(self.event, self.target)
 
 
+_default_serialize_hook = getattr(AbstractHook.serialize_hook, '__func__', AbstractHook.serialize_hook)
+_default_deliver_hook = getattr(AbstractHook.deliver_hook, '__func__', AbstractHook.deliver_hook)
+
+
 class Hook(AbstractHook):
     if django.VERSION >= (1, 7):
         class Meta(AbstractHook.Meta):
@@ -163,6 +486,52 @@ class Hook(AbstractHook):
 
 
 
+class DeliveryLog(models.Model):
+    """
+    The outcome of one delivery attempt, written in batches when
+    `settings.HOOK_DELIVERY_LOG` is enabled.
+
+    `hook_id` is a plain integer rather than a foreign key, so logs outlive
+    their hooks and work with any hook model.
+    """
+    created = models.DateTimeField(default=timezone.now, db_index=True)
+    hook_id = models.PositiveIntegerField()
+    event = models.CharField('Event', max_length=64)
+    target = models.URLField('Target URL', max_length=255)
+    status = models.PositiveSmallIntegerField(null=True, blank=True)
+    latency = models.FloatField(null=True, blank=True)
+    attempt = models.PositiveSmallIntegerField(default=1)
+    response = models.TextField(blank=True, default='')
+
+    class Meta:
+        index_together = (('hook_id', 'created'),)
+
+    def __unicode__(self):
+        return u'{} => {} ({})'.format(self.event, self.target, self.status)
+
+
+class EventLog(models.Model):
+    """
+    Append-only log of model events for replaying them to a hook later,
+    written when `settings.HOOK_EVENT_LOG` is enabled.
+
+    Only the instance's model and pk are kept, not the payload; replayed
+    events are serialized from the current state of the instance.
+    """
+    created = models.DateTimeField(default=timezone.now, db_index=True)
+    event = models.CharField('Event', max_length=64)
+    model_label = models.CharField(max_length=100)
+    object_pk = models.CharField(max_length=64)
+    action = models.CharField(max_length=64, blank=True, default='')
+    user_pk = models.CharField(max_length=64, blank=True, default='')
+
+    class Meta:
+        index_together = (('event', 'created'),)
+
+    def __unicode__(self):
+        return u'{} {}:{}'.format(self.event, self.model_label, self.object_pk)
+
+
 ##############
 ### EVENTS ###
 ##############
@@ -178,7 +547,6 @@ def get_model_label(instance):
         return '.'.join([opts.app_label, opts.object_name])
 
 
-@receiver(post_save, dispatch_uid='instance-saved-hook')
 def model_saved(sender, instance,
                         created,
                         raw,
@@ -192,7 +560,6 @@ def model_saved(sender, instance,
     distill_model_event(instance, model_label, action)
 
 
-@receiver(post_delete, dispatch_uid='instance-deleted-hook')
 def model_deleted(sender, instance,
                           using,
                           **kwargs):
@@ -203,7 +570,6 @@ def model_deleted(sender, instance,
     distill_model_event(instance, model_label, 'deleted')
 
 
-@receiver(hook_event, dispatch_uid='instance-custom-hook')
 def custom_action(sender, action,
                           instance,
                           user=None,
@@ -215,7 +581,6 @@ def custom_action(sender, action,
     distill_model_event(instance, model_label, action, user_override=user)
 
 
-@receiver(raw_hook_event, dispatch_uid='raw-custom-hook')
 def raw_custom_event(
         sender,
         event_name,
@@ -234,10 +599,8 @@ def raw_custom_event(
     new_payload = payload
 
     if send_hook_meta:
-        new_payload = lambda hook, instance: {
-            'hook': hook.dict(),
-            'data': payload
-        }
+        # encode the (possibly large) payload once for all subscribers
+        new_payload = PreEncodedPayload(payload)
 
     distill_model_event(
         instance,
@@ -250,6 +613,38 @@ def raw_custom_event(
     )
 
 
+def invalidate_hook_caches(sender, instance=None, **kwargs):
+    """
+    Drop per-hook caches when hooks are changed, one by one or in bulk.
+    """
+    if instance is None:
+        clear_condition_cache()
+        signing.clear_cache()
+        subscriptions_changed()
+    elif isinstance(instance, AbstractHook):
+        clear_condition_cache(instance.pk)
+        signing.clear_cache(instance.pk)
+        subscriptions_changed()
+
+
+def connect_signals():
+    """
+    Wire the hook receivers up. Called from `RestHooksConfig.ready()`.
+    """
+    post_save.connect(model_saved, dispatch_uid='instance-saved-hook')
+    post_delete.connect(model_deleted, dispatch_uid='instance-deleted-hook')
+    hook_event.connect(custom_action, dispatch_uid='instance-custom-hook')
+    raw_hook_event.connect(raw_custom_event, dispatch_uid='raw-custom-hook')
+    post_save.connect(invalidate_hook_caches, dispatch_uid='hook-saved-caches')
+    post_delete.connect(invalidate_hook_caches, dispatch_uid='hook-deleted-caches')
+    hooks_bulk_changed.connect(invalidate_hook_caches, dispatch_uid='hooks-bulk-changed-caches')
+
+
+if django.VERSION < (1, 7):
+    # no app registry, so no AppConfig.ready() to do it for us
+    connect_signals()
+
+
 @receiver(setting_changed)
 def handle_hook_events_change(sender, setting, *args, **kwargs):
     global _HOOK_EVENT_ACTIONS_CONFIG
@@ -257,3 +652,5 @@ def handle_hook_events_change(sender, setting, *args, **kwargs):
     if setting == 'HOOK_EVENTS':
         _HOOK_EVENT_ACTIONS_CONFIG = None
         HOOK_EVENTS = settings.HOOK_EVENTS
+    elif setting == 'HOOK_TRANSPORT':
+        reset_transport()
@@ -0,0 +1,61 @@
+from django.core.serializers.json import DjangoJSONEncoder
+
+try:
+    # Django <= 1.6 backwards compatibility
+    from django.utils import simplejson as json
+except ImportError:
+    # Django >= 1.7
+    import json
+
+
+def encode_payload(payload):
+    """
+    Encode a payload to the JSON string that gets POSTed.
+    """
+    return json.dumps(payload, cls=DjangoJSONEncoder)
+
+
+def splice_payload(envelope, data):
+    """
+    The encoded `{"hook": ..., "data": ...}` body from its encoded halves,
+    both bytes.
+    """
+    return b''.join([b'{"hook": ', envelope, b', "data": ', data, b'}'])
+
+
+class PreEncodedPayload(object):
+    """
+    A `{'hook': ..., 'data': ...}` payload whose `data` is encoded only once.
+
+    When the same data fans out to many hooks, only the small per-hook
+    envelope is encoded for each of them and spliced around the shared body,
+    so the cost is O(len(data) + N * len(envelope)) instead of
+    O(N * len(data)). The bytes are identical to encoding `for_hook(hook)`.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self._encoded_data = None
+
+    @property
+    def encoded_data(self):
+        if self._encoded_data is None:
+            self._encoded_data = encode_payload(self.data).encode('utf-8')
+        return self._encoded_data
+
+    def for_hook(self, hook):
+        return {
+            'hook': hook.dict(),
+            'data': self.data,
+        }
+
+    def __call__(self, hook, instance=None):
+        # the `payload_override(hook, instance)` callable protocol, for
+        # deliver_hook overrides and finders that don't know this class
+        return self.for_hook(hook)
+
+    def encode_envelope(self, hook):
+        return encode_payload(hook.dict()).encode('utf-8')
+
+    def encode_for_hook(self, hook):
+        return splice_payload(self.encode_envelope(hook), self.encoded_data)
@@ -0,0 +1,201 @@
+"""
+Opt-in timing of the hook dispatch pipeline.
+
+Set `HOOK_PROFILE = True` to record how long every stage of a dispatch takes
+(`distill`, `find`, `serialize`, `encode` and `deliver`) together with the
+event name and model label. `deliver` is the hand-off of a batch of
+deliveries to the transport. Records go into an in-process ring buffer of
+`HOOK_PROFILE_BUFFER_SIZE` entries which `summarize()` aggregates.
+
+With `HOOK_PROFILE_DIR` set, every process also writes its buffer to a
+`rest_hooks-<pid>.timings` file there, at most every
+`HOOK_PROFILE_WRITE_INTERVAL` seconds and on exit, so the `hook_profile`
+management command can aggregate the timings of the running processes.
+
+With `HOOK_PROFILE_SAMPLE_RATE` (0.0 - 1.0) set as well, that fraction of
+dispatches also runs under cProfile and the stats are dumped to
+`HOOK_PROFILE_DIR` for later inspection with `pstats`.
+"""
+import atexit
+import collections
+import glob
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+timer = getattr(time, 'perf_counter', time.time)
+
+STAGES = ('distill', 'find', 'serialize', 'encode', 'deliver')
+
+_records = None
+_records_lock = threading.Lock()
+_written_at = 0
+_local = threading.local()
+
+
+def is_enabled():
+    return bool(getattr(settings, 'HOOK_PROFILE', False))
+
+
+def get_records():
+    """
+    The ring buffer of `(stage, event_name, model_label, seconds)` tuples.
+    """
+    global _records
+    if _records is None:
+        with _records_lock:
+            if _records is None:
+                size = getattr(settings, 'HOOK_PROFILE_BUFFER_SIZE', 10000)
+                _records = collections.deque(maxlen=size)
+    return _records
+
+
+def clear():
+    """
+    Empty the ring buffer and remove the timings files of all processes.
+    """
+    global _records
+    with _records_lock:
+        _records = None
+    for filename in get_timings_files():
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+
+
+def get_timings_files():
+    profile_dir = getattr(settings, 'HOOK_PROFILE_DIR', None)
+    if not profile_dir:
+        return []
+    return sorted(glob.glob(os.path.join(profile_dir, 'rest_hooks-*.timings')))
+
+
+def write_records():
+    """
+    Write this process's ring buffer to its file in `HOOK_PROFILE_DIR`.
+    """
+    global _written_at
+    profile_dir = getattr(settings, 'HOOK_PROFILE_DIR', None)
+    if not profile_dir or _records is None:
+        return
+    _written_at = time.time()
+    filename = os.path.join(profile_dir, 'rest_hooks-{0}.timings'.format(os.getpid()))
+    try:
+        with open(filename + '.tmp', 'w') as f:
+            json.dump(list(_records), f)
+        # readers never see a half-written file
+        os.rename(filename + '.tmp', filename)
+    except (IOError, OSError):
+        pass
+
+
+def load_records():
+    """
+    The records of every process that wrote to `HOOK_PROFILE_DIR`, and this
+    process's own buffer.
+    """
+    own = os.path.join(getattr(settings, 'HOOK_PROFILE_DIR', None) or '',
+                       'rest_hooks-{0}.timings'.format(os.getpid()))
+    records = list(get_records())
+    for filename in get_timings_files():
+        if filename == own:
+            continue
+        try:
+            with open(filename) as f:
+                records.extend(tuple(entry) for entry in json.load(f))
+        except (IOError, OSError, ValueError):
+            pass
+    return records
+
+
+def start():
+    """
+    Returns a start time to hand to `record()`, or None if profiling is off.
+    """
+    if not is_enabled():
+        return None
+    return timer()
+
+
+def record(stage, started, event_name=None, model_label=None):
+    if started is None:
+        return
+    get_records().append((stage, event_name, model_label, timer() - started))
+    if time.time() - _written_at >= getattr(settings, 'HOOK_PROFILE_WRITE_INTERVAL', 5.0):
+        write_records()
+
+
+@contextmanager
+def profile(stage, event_name=None, model_label=None):
+    started = start()
+    try:
+        yield
+    finally:
+        record(stage, started, event_name, model_label)
+
+
+@contextmanager
+def sample(event_name):
+    """
+    Run the block under cProfile for a sampled fraction of dispatches.
+    """
+    profile_dir = getattr(settings, 'HOOK_PROFILE_DIR', None)
+    rate = getattr(settings, 'HOOK_PROFILE_SAMPLE_RATE', 0)
+    # cProfile can't nest, so hooks fired while delivering are not sampled
+    if (not is_enabled() or not profile_dir or not rate or
+            getattr(_local, 'sampling', False) or random.random() >= rate):
+        yield
+        return
+
+    import cProfile
+    profiler = cProfile.Profile()
+    _local.sampling = True
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        _local.sampling = False
+        filename = 'rest_hooks-{0}-{1}-{2}.prof'.format(
+            event_name, int(time.time() * 1000), os.getpid()
+        )
+        profiler.dump_stats(os.path.join(profile_dir, filename))
+
+
+def summarize(by='event', limit=10, stages=None):
+    """
+    Aggregate the records of all processes (see `load_records()`) into the
+    slowest `(stage, event|model)` pairs.
+
+    Returns a list of dicts with `stage`, `key`, `count`, `total`, `mean` and
+    `max` (seconds), sorted by total time spent.
+    """
+    if by not in ('event', 'model'):
+        raise ValueError('`by` must be "event" or "model".')
+    totals = {}
+    for stage, event_name, model_label, seconds in load_records():
+        if stages and stage not in stages:
+            continue
+        key = (stage, event_name if by == 'event' else model_label)
+        row = totals.get(key)
+        if row is None:
+            row = totals[key] = {'stage': stage, 'key': key[1], 'count': 0, 'total': 0.0, 'max': 0.0}
+        row['count'] += 1
+        row['total'] += seconds
+        row['max'] = max(row['max'], seconds)
+
+    rows = sorted(totals.values(), key=lambda row: row['total'], reverse=True)[:limit]
+    for row in rows:
+        row['mean'] = row['total'] / row['count']
+    return rows
+
+
+# the last records of an exiting process
+atexit.register(write_records)
@@ -0,0 +1,173 @@
+import atexit
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, router
+from django.db.models import Q
+from django.utils import timezone
+
+try:
+    from django.apps import apps
+    get_model = apps.get_model
+except ImportError:
+    # Django < 1.7
+    from django.db.models import get_model
+
+from rest_hooks.delivery_log import DeliveryLogBuffer
+from rest_hooks.utils import get_log_database, prefetch_for_event
+
+
+def is_enabled():
+    return bool(getattr(settings, 'HOOK_EVENT_LOG', False))
+
+
+def get_database():
+    """
+    Where the log is written: `settings.HOOK_LOG_DATABASE`, else wherever
+    the routers send `EventLog` writes.
+    """
+    alias = get_log_database()
+    if alias is None:
+        from rest_hooks.models import EventLog
+        alias = router.db_for_write(EventLog) or DEFAULT_DB_ALIAS
+    return alias
+
+
+class EventLogBuffer(DeliveryLogBuffer):
+    """
+    Writes event log rows with one `bulk_create` per
+    `HOOK_EVENT_LOG_BATCH_SIZE` rows, or on the first event after
+    `HOOK_EVENT_LOG_FLUSH_INTERVAL` seconds.
+    """
+    batch_size_setting = 'HOOK_EVENT_LOG_BATCH_SIZE'
+    flush_interval_setting = 'HOOK_EVENT_LOG_FLUSH_INTERVAL'
+
+    def get_model(self):
+        from rest_hooks.models import EventLog
+        return EventLog
+
+    def get_database(self):
+        return get_database()
+
+
+_buffer = EventLogBuffer()
+
+
+def flush():
+    """
+    Write the buffered events now. Returns the number of rows written.
+    """
+    try:
+        return _buffer.flush()
+    except DatabaseError:
+        # the log must never break a save, the batch is dropped
+        return 0
+
+
+def record_event(event_name, instance, user=None):
+    """
+    Append an event to the `EventLog`: just enough to find the instance
+    again, the payload is serialized anew on replay. `user` is a user or
+    its pk.
+
+    Rows are buffered and written in batches. Deletes are not logged, there
+    is nothing left to serialize on replay.
+    """
+    from rest_hooks.models import get_event_config, get_model_label
+
+    pk = getattr(instance, 'pk', None)
+    if pk is None:
+        return None
+    auto = get_event_config(event_name).get('action')
+    action = auto.rsplit('.', 1)[1].rstrip('+') if auto else ''
+    if action == 'deleted':
+        return
+    entry = {
+        'created': timezone.now(),
+        'event': event_name,
+        'model_label': get_model_label(instance),
+        'object_pk': str(pk),
+        'action': action,
+        'user_pk': str(getattr(user, 'pk', user)) if user is not None else '',
+    }
+    if _buffer.add(entry):
+        flush()
+
+
+def iter_events(hook, since=None, until=None, cursor=None, batch_size=500):
+    """
+    Yield the events `hook` subscribed to as lists of at most `batch_size`
+    `EventLog` rows in id order, starting after the `cursor` id.
+
+    Batches are fetched by keyset (`id > last id`), so every batch costs the
+    same however far into the log it is.
+    """
+    from rest_hooks.models import EventLog
+
+    # this process's latest events too
+    flush()
+    queryset = EventLog.objects.db_manager(get_log_database()).filter(event=hook.event).filter(
+        Q(user_pk=str(hook.user_id)) | Q(user_pk='')
+    )
+    if since is not None:
+        queryset = queryset.filter(created__gte=since)
+    if until is not None:
+        queryset = queryset.filter(created__lt=until)
+    queryset = queryset.order_by('id')
+
+    while True:
+        if cursor is not None:
+            batch = list(queryset.filter(id__gt=cursor)[:batch_size])
+        else:
+            batch = list(queryset[:batch_size])
+        if not batch:
+            return
+        yield batch
+        cursor = batch[-1].id
+
+
+def load_instances(events):
+    """
+    The instances of a batch of events, with one `in_bulk` per model.
+    Returns a dict keyed by `(model_label, object_pk)`; deleted instances
+    are missing.
+    """
+    pks = {}
+    for event in events:
+        pks.setdefault(event.model_label, set()).add(event.object_pk)
+
+    instances = {}
+    for model_label, object_pks in pks.items():
+        app_label, model_name = model_label.split('.', 1)
+        model = get_model(app_label, model_name)
+        pk_field = model._meta.pk
+        found = model._default_manager.in_bulk([pk_field.to_python(pk) for pk in object_pks])
+        for pk, instance in found.items():
+            instances[(model_label, str(pk))] = instance
+    return instances
+
+
+def replay(hook, since=None, until=None, cursor=None, batch_size=500):
+    """
+    Redeliver the logged events between `since` and `until` to `hook`.
+
+    Yields `(cursor, delivered)` after each batch; pass the last cursor back
+    in to resume an interrupted replay. Events whose instance no longer
+    exists, or that don't match the hook's condition, are skipped.
+    """
+    for events in iter_events(hook, since=since, until=until, cursor=cursor, batch_size=batch_size):
+        instances = load_instances(events)
+        prefetch_for_event(hook.event, list(instances.values()))
+        delivered = 0
+        for event in events:
+            instance = instances.get((event.model_label, event.object_pk))
+            if instance is None:
+                continue
+            if hook.condition and not hook.matches(instance):
+                continue
+            hook.deliver_hook(instance)
+            delivered += 1
+        yield events[-1].id, delivered
+
+
+# rows still buffered when the process exits
+atexit.register(flush)
@@ -0,0 +1,117 @@
+import threading
+from operator import attrgetter
+
+from django.db.models import Field
+from django.utils.encoding import is_protected_type
+
+
+MAX_CACHED_PLANS = 1000
+
+_plans = {}
+_plans_lock = threading.Lock()
+
+
+def get_remote_field(field):
+    try:
+        return field.remote_field
+    except AttributeError:
+        # Django < 1.9
+        return field.rel
+
+
+def get_accessor(field):
+    """
+    `field.value_from_object`, as a plain attribute getter unless the field
+    type overrides it.
+    """
+    if type(field).value_from_object is Field.value_from_object:
+        return attrgetter(field.attname)
+    return field.value_from_object
+
+
+def get_serialization_plan(model, fields=None):
+    """
+    The precomputed `(label, pk_field, [(name, field, accessor, is_m2m)])`
+    plan for serializing instances of `model`, cached per model class and
+    field projection. `fields` may be any iterable of field names.
+
+    Field selection follows `django.core.serializers`: the concrete model's
+    local fields with `serialize=True`, matching foreign keys by their name.
+    """
+    if fields is not None and not isinstance(fields, tuple):
+        fields = tuple(sorted(set(fields)))
+    key = (model, fields)
+    plan = _plans.get(key)
+    if plan is not None:
+        return plan
+
+    opts = model._meta.concrete_model._meta
+    selected = set(fields) if fields is not None else None
+    accessors = []
+    for field in opts.local_fields:
+        if not field.serialize:
+            continue
+        name = field.attname if get_remote_field(field) is None else field.attname[:-3]
+        if selected is None or name in selected:
+            accessors.append((field.name, field, get_accessor(field), False))
+    for field in opts.local_many_to_many:
+        if not field.serialize or not get_remote_field(field).through._meta.auto_created:
+            continue
+        if selected is None or field.attname in selected:
+            accessors.append((field.name, field, None, True))
+
+    plan = (str(model._meta), model._meta.pk, accessors)
+    with _plans_lock:
+        # hooks can ask for arbitrary projections, keep the cache bounded
+        if len(_plans) >= MAX_CACHED_PLANS:
+            _plans.clear()
+        _plans[key] = plan
+    return plan
+
+
+def condition_values(instance, fields=None):
+    """
+    What hook conditions may test on an instance: only the fields the
+    default serializer exposes for the projection (foreign keys as their
+    pk, many-to-many fields left out) and the pk, never related objects.
+    """
+    label, pk_field, accessors = get_serialization_plan(type(instance), fields)
+    values = {'pk': instance.pk, pk_field.name: instance.pk}
+    for name, field, accessor, is_m2m in accessors:
+        if not is_m2m:
+            values[name] = accessor(instance) if accessor is not None else field.value_from_object(instance)
+    return values
+
+
+def value_from_field(obj, field, accessor=None):
+    value = accessor(obj) if accessor is not None else field.value_from_object(obj)
+    # Protected types (None, numbers, dates, Decimals) are passed through as
+    # is, everything else is converted to a string like Django does.
+    return value if is_protected_type(value) else field.value_to_string(obj)
+
+
+def serialize_instance(instance, fields=None):
+    """
+    The default `data` of a hook payload: the same `model`, `pk` and
+    `fields` structure as `serializers.serialize('python', [instance])`,
+    optionally restricted to the given field names.
+
+    Built directly from a cached per-model plan, without a serializer object,
+    stream handling or intermediate OrderedDicts.
+    """
+    label, pk_field, accessors = get_serialization_plan(type(instance), fields)
+    data = {}
+    for name, field, accessor, is_m2m in accessors:
+        if is_m2m:
+            related = getattr(instance, '_prefetched_objects_cache', {}).get(field.name)
+            if related is None:
+                related = getattr(instance, field.name).only('pk').iterator()
+            data[name] = [value_from_field(obj, obj._meta.pk) for obj in related]
+        else:
+            data[name] = value_from_field(instance, field, accessor)
+
+    return {
+        'model': label,
+        'pk': value_from_field(instance, pk_field),
+        'fields': data,
+    }
@@ -4,3 +4,5 @@ from django.dispatch import Signal
 hook_event = Signal(providing_args=['action', 'instance'])
 raw_hook_event = Signal(providing_args=['event_name', 'payload', 'user'])
 hook_sent_event = Signal(providing_args=['payload', 'instance', 'hook'])
+hooks_bulk_changed = Signal(providing_args=['action'])
+hook_delivery_failed = Signal(providing_args=['method', 'url', 'data', 'response', 'exception', 'attempts'])
@@ -0,0 +1,52 @@
+import binascii
+import hashlib
+import hmac
+import os
+import threading
+from collections import OrderedDict
+
+
+MAX_CACHED_KEYS = 1000
+
+_keys = OrderedDict()
+_keys_lock = threading.Lock()
+
+
+def generate_secret():
+    """
+    A random secret for a new hook.
+    """
+    return binascii.hexlify(os.urandom(32)).decode('ascii')
+
+
+def get_key(hook):
+    """
+    An HMAC-SHA256 object keyed with the hook's secret, ready to be copied
+    for each body. Kept in an LRU cache by hook id, checked against the
+    secret so a changed secret is never signed with the old one.
+    """
+    with _keys_lock:
+        entry = _keys.pop(hook.pk, None)
+        if entry is None or entry[0] != hook.secret:
+            entry = (hook.secret, hmac.new(hook.secret.encode('utf-8'), digestmod=hashlib.sha256))
+        _keys[hook.pk] = entry
+        while len(_keys) > MAX_CACHED_KEYS:
+            _keys.popitem(last=False)
+    return entry[1]
+
+
+def sign(hook, body):
+    """
+    The `sha256=<hex digest>` signature of the exact `body` bytes.
+    """
+    mac = get_key(hook).copy()
+    mac.update(body)
+    return 'sha256=' + mac.hexdigest()
+
+
+def clear_cache(hook_id=None):
+    with _keys_lock:
+        if hook_id is None:
+            _keys.clear()
+        else:
+            _keys.pop(hook_id, None)
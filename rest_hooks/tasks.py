@@ -5,6 +5,7 @@ from celery.task import Task
 
 from django.core.serializers.json import DjangoJSONEncoder
 
+from rest_hooks.payloads import splice_payload
 from rest_hooks.utils import get_hook_model
 
 
@@ -29,6 +30,39 @@ class DeliverHook(Task):
 
         # would be nice to log this, at least for a little while...
 
+class DeliverHooks(Task):
+    def run(self, deliveries, data=None, **kwargs):
+        """
+        deliveries: a batch of dicts with the `url` and `headers` of each
+                    request, the `hook_id`, and either the encoded `data` or
+                    the encoded `hook` envelope to splice with `data`.
+        data:       the encoded data shared by the batch, if any.
+
+        Sent from `rest_hooks.transports.CeleryTransport`.
+        """
+        session = requests.Session()
+        gone = []
+        for delivery in deliveries:
+            if 'hook' in delivery:
+                body = splice_payload(delivery['hook'].encode('utf-8'), data.encode('utf-8'))
+            else:
+                body = delivery['data']
+            try:
+                response = session.post(
+                    url=delivery['url'],
+                    data=body,
+                    headers=delivery['headers']
+                )
+            except requests.RequestException:
+                # one unreachable target must not cost the rest of the batch
+                continue
+            if response.status_code == 410 and delivery.get('hook_id'):
+                gone.append(delivery['hook_id'])
+
+        if gone:
+            get_hook_model().objects.filter(id__in=gone).delete()
+
+
 def deliver_hook_wrapper(target, payload, instance=None, hook=None, **kwargs):
     if hook:
         kwargs['hook_id'] = hook.id
@@ -4,6 +4,11 @@ from mock import patch, MagicMock, ANY
 
 from datetime import datetime
 
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
 try:
     # Django <= 1.6 backwards compatibility
     from django.utils import simplejson as json
@@ -12,7 +17,9 @@ except ImportError:
     import json
 
 from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
 from django.contrib.sites.models import Site
+from django.db.models.signals import post_delete
 from django.test import TestCase
 from django.test.utils import override_settings
 try:
@@ -38,10 +45,41 @@ HOOK_EVENTS_OVERRIDE = {
     'special.thing':        None,
 }
 
+PREFETCH_HOOK_EVENTS = dict(HOOK_EVENTS_OVERRIDE)
+PREFETCH_HOOK_EVENTS['user.pinged'] = {
+    'action': 'auth.User.pinged',
+    'prefetch_related': ['groups'],
+}
+
 ALT_HOOK_EVENTS = dict(HOOK_EVENTS_OVERRIDE)
 ALT_HOOK_EVENTS['comment.moderated'] += '+'
 
 
+def serialize_with_groups(instance, hook):
+    return {
+        'hook': hook.dict(),
+        'data': {
+            'username': instance.username,
+            'groups': [group.name for group in instance.groups.all()],
+        }
+    }
+
+
+def legacy_deliver_hook(self, instance, payload_override=None):
+    """ A `deliver_hook` override written against the 1.x API. """
+    if payload_override is None:
+        payload = self.serialize_hook(instance)
+    else:
+        payload = payload_override
+    if callable(payload):
+        payload = payload(self, instance)
+    models.client.post(
+        url=self.target,
+        data=json.dumps(payload, cls=DjangoJSONEncoder),
+        headers={'Content-Type': 'application/json'}
+    )
+
+
 @override_settings(HOOK_EVENTS=HOOK_EVENTS_OVERRIDE, HOOK_DELIVERER=None)
 class RESTHooksTest(TestCase):
     """
@@ -129,6 +167,37 @@ class RESTHooksTest(TestCase):
         self.assertEquals('Hello world!', payload['data']['fields']['comment'])
         self.assertEquals(comment.user.id, payload['data']['fields']['user'])
 
+    def test_fast_serializer_matches_django(self):
+        from django.contrib.auth.models import Group
+        from django.core import serializers
+        from rest_hooks.serializers import serialize_instance
+
+        def django_serialize(instance, fields=None):
+            return json.loads(json.dumps(serializers.serialize('python', [instance], fields=fields)[0],
+                                         cls=DjangoJSONEncoder))
+
+        def fast_serialize(instance, fields=None):
+            return json.loads(json.dumps(serialize_instance(instance, fields=fields), cls=DjangoJSONEncoder))
+
+        self.user.groups.add(Group.objects.create(name='readers'))
+        comment = Comment.objects.create(
+            site=self.site,
+            content_object=self.user,
+            user=self.user,
+            comment='Hello world!'
+        )
+        for instance in [comment, self.user, self.site]:
+            self.assertEquals(django_serialize(instance), fast_serialize(instance))
+        for fields in [('comment', 'user'), ('groups', 'username'), (), ['user', 'comment'], set(['username'])]:
+            for instance in [comment, self.user]:
+                self.assertEquals(django_serialize(instance, fields), fast_serialize(instance, fields))
+
+        from rest_hooks import serializers as fast_serializers
+        with patch.object(fast_serializers, 'MAX_CACHED_PLANS', 2):
+            for fields in [('comment',), ('user',), ('site',)]:
+                fast_serialize(comment, fields)
+            self.assertTrue(len(fast_serializers._plans) <= 2)
+
     def test_comment_hook_serializer_method(self):
         """
         Use custom serialize_hook on the Comment model.
@@ -239,6 +308,24 @@ class RESTHooksTest(TestCase):
         self.assertEquals('special.thing', payload['hook']['event'])
         self.assertEquals('world!', payload['data']['hello'])
 
+    @patch('rest_hooks.models.client.post')
+    def test_raw_custom_event_encodes_payload_once(self, method_mock):
+        from rest_hooks.payloads import encode_payload
+
+        hooks = [self.make_hook('special.thing', 'http://example.com/raw/%s' % n) for n in range(3)]
+        data = {'hello': 'world!', 'when': datetime(2020, 1, 1), 'items': list(range(10))}
+
+        with patch('rest_hooks.payloads.encode_payload', wraps=encode_payload) as encode_mock:
+            signals.raw_hook_event.send(sender=None, event_name='special.thing', payload=data, user=self.user)
+        # the data once, plus one small envelope per hook
+        self.assertEquals(1, [call[1][0] for call in encode_mock.mock_calls].count(data))
+        self.assertEquals(4, len(encode_mock.mock_calls))
+
+        bodies = dict((call[2]['url'], call[2]['data']) for call in method_mock.mock_calls)
+        for hook in hooks:
+            expected = encode_payload({'hook': hook.dict(), 'data': data}).encode('utf-8')
+            self.assertEquals(expected, bodies[hook.target])
+
     def test_timed_cycle(self):
         return # basically a debug test for thread pool bit
         target = 'http://requestbin.zapier.com/api/v1/bin/test_timed_cycle'
@@ -274,6 +361,513 @@ class RESTHooksTest(TestCase):
 
         requests.delete(target + '/view') # cleanup to be polite
 
+    @patch('requests.Session.post')
+    def test_client_stats(self, method_mock):
+        from rest_hooks.client import Client
+
+        method_mock.return_value = MagicMock(status_code=200)
+        client = Client(num_threads=3)
+        for n in range(30):
+            client.post(url='http://example.com/test_client_stats', data='{}')
+        client.close()
+
+        stats = client.get_stats()
+        self.assertEquals(30, stats['enqueued'])
+        self.assertEquals(30, stats['sent'])
+        self.assertEquals(30, client.total_sent)
+        self.assertEquals(0, stats['failed'])
+        self.assertEquals(0, stats['queue_depth'])
+        self.assertEquals(0, stats['active_workers'])
+        self.assertEquals(0.0, stats['oldest_age'])
+
+    @override_settings(HOOK_PROFILE=True)
+    def test_profiling(self):
+        from django.core.management import call_command
+        from rest_hooks import profiling
+
+        profiling.clear()
+        self.perform_create_request_cycle()
+
+        stages = set(record[0] for record in profiling.get_records())
+        self.assertEquals(set(profiling.STAGES), stages)
+
+        rows = profiling.summarize(by='model')
+        self.assertIn((comments_app_label + '.Comment').lower(),
+                      [str(row['key']).lower() for row in rows])
+
+        out = StringIO()
+        call_command('hook_profile', by='event', stdout=out)
+        self.assertIn('comment.added', out.getvalue())
+        profiling.clear()
+
+    @override_settings(HOOK_PROFILE=True)
+    def test_profiling_across_processes(self):
+        import os
+        import shutil
+        import tempfile
+        from django.core.management import call_command
+        from rest_hooks import profiling
+
+        profile_dir = tempfile.mkdtemp()
+        try:
+            with override_settings(HOOK_PROFILE_DIR=profile_dir):
+                profiling.clear()
+                self.perform_create_request_cycle()
+                profiling.write_records()
+                self.assertTrue(os.path.exists(os.path.join(profile_dir, 'rest_hooks-%s.timings' % os.getpid())))
+                # what another worker process wrote
+                with open(os.path.join(profile_dir, 'rest_hooks-1.timings'), 'w') as f:
+                    json.dump([['find', 'other.event', 'app.Model', 0.5]], f)
+
+                out = StringIO()
+                call_command('hook_profile', by='event', clear=True, stdout=out)
+                self.assertIn('comment.added', out.getvalue())
+                self.assertIn('other.event', out.getvalue())
+                self.assertEquals([], profiling.get_timings_files())
+        finally:
+            shutil.rmtree(profile_dir)
+
+    def test_loadtest_command(self):
+        from django.core.management import call_command
+
+        out = StringIO()
+        built = []
+        build_client = models.build_client
+
+        def spy():
+            built.append(build_client())
+            return built[-1]
+
+        # a configured transport mustn't stand in for the backends under test
+        with override_settings(HOOK_TRANSPORT='rest_hooks.transports.InMemoryTransport', HOOK_RETRY_MAX_ATTEMPTS=3):
+            with patch.object(models, 'build_client', spy):
+                call_command('hooks_loadtest', hooks=2, rate=50, duration=0.1, backend=['session', 'client'],
+                             stdout=out)
+        output = out.getvalue()
+        # built from settings, and closed after the run
+        self.assertEquals(3, built[0].max_attempts)
+        self.assertTrue(built[0].closing)
+
+        self.assertIn('session', output)
+        self.assertIn('client', output)
+        self.assertEquals(2, output.count('deliveries:        10 / 10'))
+        self.assertFalse(Hook.objects.exists())
+
+    @patch('requests.Session.post')
+    def test_client_scales_with_backlog(self, method_mock):
+        from rest_hooks.client import Client
+
+        def slow_post(*args, **kwargs):
+            time.sleep(0.05)
+            return MagicMock(status_code=200)
+        method_mock.side_effect = slow_post
+
+        client = Client(min_threads=1, max_threads=4, idle_timeout=0.1, max_backlog=0.01)
+        self.assertEquals(1, client.workers)
+        for n in range(20):
+            client.post(url='http://example.com/test_client_scales_with_backlog', data='{}')
+        self.assertEquals(4, client.workers)
+
+        # idle workers shrink back to min_threads
+        deadline = time.time() + 5
+        while (client.queue or client.workers > 1) and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEquals(1, client.workers)
+        self.assertEquals(20, client.total_sent)
+        client.close()
+
+    @patch('requests.Session.post')
+    def test_client_retries_with_backoff(self, method_mock):
+        from rest_hooks.client import Client
+
+        method_mock.side_effect = [
+            requests.ConnectionError('refused'),
+            MagicMock(status_code=503, headers={}),
+            MagicMock(status_code=200),
+        ]
+        dead_letter = MagicMock()
+        client = Client(max_attempts=3, retry_base_delay=0.01, retry_max_delay=0.05, dead_letter=dead_letter)
+        client.post(url='http://example.com/test_client_retries_with_backoff', data='{}')
+
+        deadline = time.time() + 5
+        while client.total_sent < 1 and time.time() < deadline:
+            time.sleep(0.01)
+        client.close()
+
+        stats = client.get_stats()
+        self.assertEquals(3, method_mock.call_count)
+        self.assertEquals(1, stats['sent'])
+        self.assertEquals(2, stats['failed'])
+        self.assertEquals(2, stats['retried'])
+        self.assertEquals(0, stats['dropped'])
+        self.assertFalse(dead_letter.called)
+
+    @patch('requests.Session.post')
+    def test_client_after_fork(self, method_mock):
+        from rest_hooks.client import Client
+
+        method_mock.return_value = MagicMock(status_code=200)
+        client = Client(min_threads=0)
+        # what a forked child inherits: counters without threads behind them
+        client.workers = client.idle_workers = 1
+        with patch('rest_hooks.client.os.getpid', return_value=client.pid + 1):
+            client.post(url='http://example.com/test_client_after_fork', data='{}')
+            client.close()
+        self.assertEquals(1, client.stats['sent'])
+        self.assertEquals(0, len(client.queue))
+
+    def test_client_retry_delay_honors_retry_after(self):
+        from rest_hooks.client import Client
+
+        client = Client(retry_base_delay=1.0, retry_max_delay=60.0, max_pending_retry_bytes=10)
+        throttled = MagicMock(headers={'Retry-After': '120'})
+        self.assertEquals(120.0, client.retry_delay(2, throttled))
+        self.assertTrue(client.retry_delay(20) <= 60.0)
+
+        request = ('post', (), {'url': 'http://example.com/', 'data': '{}'}, time.time(), 1, None)
+        # too long a Retry-After isn't held
+        self.assertFalse(client.schedule_retry(request, throttled))
+        self.assertTrue(client.schedule_retry(request, MagicMock(headers={'Retry-After': '30'})))
+        self.assertEquals(2, client.get_stats()['retry_bytes'])
+        # nor more than max_pending_retry_bytes of bodies
+        big = ('post', (), {'url': 'http://example.com/', 'data': 'x' * 9}, time.time(), 1, None)
+        self.assertFalse(client.schedule_retry(big))
+        client.retries[0] = (0,) + client.retries[0][1:]
+        self.assertEquals(request[2], client.next_request()[2])
+        self.assertEquals(0, client.retry_bytes)
+        client.close()
+
+    @patch('requests.Session.post')
+    def test_client_dead_letter(self, method_mock):
+        from rest_hooks.client import Client
+
+        response = MagicMock(status_code=500, headers={})
+        method_mock.return_value = response
+        failed = MagicMock()
+        signals.hook_delivery_failed.connect(failed)
+
+        client = Client(max_attempts=2, retry_base_delay=0.01, dead_letter=models.send_dead_letter)
+        client.post(url='http://example.com/test_client_dead_letter', data='{}')
+        deadline = time.time() + 5
+        while not client.stats['dropped'] and time.time() < deadline:
+            time.sleep(0.01)
+        client.close()
+        signals.hook_delivery_failed.disconnect(failed)
+
+        self.assertEquals(2, method_mock.call_count)
+        self.assertEquals(1, client.stats['dropped'])
+        failed.assert_called_once_with(
+            signal=ANY, sender=None, method='post', url='http://example.com/test_client_dead_letter',
+            data='{}', response=response, exception=None, attempts=2
+        )
+
+    @override_settings(HOOK_DELIVERY_LOG=True, HOOK_DELIVERY_LOG_BATCH_SIZE=2, HOOK_DELIVERY_LOG_RESPONSE_SIZE=10)
+    @patch('rest_hooks.models.client.post')
+    def test_delivery_log(self, method_mock):
+        from rest_hooks import delivery_log
+
+        method_mock.return_value = MagicMock(status_code=200, text='accepted' * 10)
+        hook = self.make_hook('special.thing', 'http://example.com/test_delivery_log')
+        for n in range(3):
+            hook.deliver_hook(None, payload_override={'n': n})
+
+        # the first two rows were written as one batch, the third is buffered
+        self.assertEquals(2, models.DeliveryLog.objects.count())
+        self.assertEquals(1, delivery_log.flush())
+        log = models.DeliveryLog.objects.filter(hook_id=hook.pk).first()
+        self.assertEquals('special.thing', log.event)
+        self.assertEquals(200, log.status)
+        self.assertEquals(1, log.attempt)
+        self.assertEquals('acceptedac', log.response)
+        self.assertTrue(log.latency >= 0)
+
+        method_mock.side_effect = requests.ConnectionError('refused')
+        with self.assertRaises(requests.ConnectionError):
+            hook.deliver_hook(None, payload_override={})
+        delivery_log.flush()
+        self.assertEquals(1, models.DeliveryLog.objects.filter(status__isnull=True).count())
+
+    @override_settings(HOOK_DELIVERY_LOG=True, HOOK_DELIVERY_LOG_BATCH_SIZE=1)
+    @patch('rest_hooks.models.client.post')
+    def test_delivery_log_failure_keeps_transaction(self, method_mock):
+        from django.db import transaction
+
+        method_mock.return_value = MagicMock(status_code=200, text='')
+        hook = self.make_hook('special.thing', 'http://example.com/test_delivery_log_failure')
+        with transaction.atomic():
+            User.objects.create_user('carol', 'carol@example.com', 'password')
+            with patch.object(models.DeliveryLog._meta, 'db_table', 'rest_hooks_missing'):
+                hook.deliver_hook(None, payload_override={})
+            # the failed log write didn't doom the caller's transaction
+            self.assertTrue(User.objects.filter(username='carol').exists())
+        self.assertEquals(0, models.DeliveryLog.objects.count())
+
+    @patch('requests.Session.post')
+    def test_client_reports_results(self, method_mock):
+        from rest_hooks.client import Client
+
+        response = MagicMock(status_code=200)
+        method_mock.return_value = response
+        on_result = MagicMock()
+        client = Client(on_result=on_result)
+        client.post(url='http://example.com/test_client_reports_results', data='{}', context={'hook_id': 1})
+        client.close()
+
+        method_mock.assert_called_once_with(url='http://example.com/test_client_reports_results', data='{}')
+        on_result.assert_called_once_with(
+            {'hook_id': 1}, response=response, exception=None, latency=ANY, attempt=1
+        )
+
+    def test_prune_hook_log(self):
+        from datetime import timedelta
+        from django.core.management import call_command
+        from django.utils import timezone
+
+        now = timezone.now()
+        models.DeliveryLog.objects.bulk_create([
+            models.DeliveryLog(hook_id=1, event='special.thing', target='http://example.com/',
+                               created=now - timedelta(days=days))
+            for days in (0, 1, 10, 40, 41, 42)
+        ])
+        out = StringIO()
+        call_command('prune_hook_log', days=30, chunk_size=2, stdout=out)
+        self.assertIn('Deleted 3', out.getvalue())
+        self.assertEquals(3, models.DeliveryLog.objects.count())
+
+    @patch('rest_hooks.models.client.post')
+    def test_signed_payloads(self, method_mock):
+        import hashlib
+        import hmac
+        from rest_hooks.signals import raw_hook_event
+
+        signed = self.make_hook('special.thing', 'http://example.com/signed')
+        signed.secret = 's3cret'
+        signed.save()
+        self.make_hook('special.thing', 'http://example.com/unsigned')
+
+        raw_hook_event.send(sender=None, event_name='special.thing', payload={'hello': 'world'}, user=self.user)
+        self.assertEquals(2, len(method_mock.mock_calls))
+        calls = dict((call[2]['url'], call[2]) for call in method_mock.mock_calls)
+
+        body = calls['http://example.com/signed']['data']
+        expected = 'sha256=' + hmac.new(b's3cret', body, hashlib.sha256).hexdigest()
+        self.assertEquals(expected, calls['http://example.com/signed']['headers']['X-Hook-Signature'])
+        self.assertEquals({'hello': 'world'}, json.loads(body.decode('utf-8'))['data'])
+        self.assertNotIn('X-Hook-Signature', calls['http://example.com/unsigned']['headers'])
+
+        # a changed secret is picked up despite the cached key
+        signed.secret = 'rotated'
+        signed.save()
+        method_mock.reset_mock()
+        with override_settings(HOOK_SIGNATURE_HEADER='X-Signature'):
+            signed.deliver_hook(None, payload_override={'hello': 'world'})
+        kwargs = method_mock.mock_calls[0][2]
+        expected = 'sha256=' + hmac.new(b'rotated', kwargs['data'], hashlib.sha256).hexdigest()
+        self.assertEquals(expected, kwargs['headers']['X-Signature'])
+
+    @override_settings(HOOK_EVENT_LOG=True, HOOK_EVENT_LOG_FLUSH_INTERVAL=3600)
+    @patch('rest_hooks.models.client.post')
+    def test_replay_hooks(self, method_mock):
+        from django.core.management import call_command
+        from rest_hooks import replay
+
+        hook = self.make_hook('comment.added', 'http://example.com/test_replay_hooks')
+        other_user = User.objects.create_user('alice', 'alice@example.com', 'password')
+        Hook.objects.create(user=other_user, event='comment.added', target='http://example.com/test_replay_hooks/alice')
+        comments = [
+            Comment.objects.create(site=self.site, content_object=self.user, user=user, comment='Hello %s' % n)
+            for n, user in enumerate([self.user, self.user, other_user, self.user])
+        ]
+        comments[1].delete()
+        self.assertEquals(4, len(method_mock.mock_calls))
+        # nobody subscribed to comment.changed, it isn't logged
+        comments[0].save()
+
+        # written in batches
+        self.assertEquals(0, models.EventLog.objects.count())
+        replay.flush()
+        self.assertFalse(models.EventLog.objects.filter(event='comment.changed').exists())
+        events = models.EventLog.objects.filter(event='comment.added').order_by('id')
+        self.assertEquals(4, events.count())
+        self.assertEquals(('created', str(comments[0].pk), str(self.user.pk)),
+                          (events[0].action, events[0].object_pk, events[0].user_pk))
+        # deletes can't be replayed and aren't logged
+        self.assertFalse(models.EventLog.objects.filter(event='comment.removed').exists())
+
+        method_mock.reset_mock()
+        out = StringIO()
+        call_command('replay_hooks', hook=hook.pk, batch_size=2, stdout=out)
+        # the deleted comment and alice's one are skipped
+        replayed = [json.loads(call[2]['data'])['data']['pk'] for call in method_mock.mock_calls]
+        self.assertEquals([comments[0].pk, comments[3].pk], replayed)
+        self.assertIn('Redelivered 2 events', out.getvalue())
+
+        method_mock.reset_mock()
+        call_command('replay_hooks', hook=hook.pk, cursor=events[0].id, stdout=StringIO())
+        self.assertEquals(1, len(method_mock.mock_calls))
+
+        # the user may be given as a pk
+        user_hook = self.make_hook('user.pinged', 'http://example.com/test_replay_hooks/user')
+        with override_settings(HOOK_EVENTS=PREFETCH_HOOK_EVENTS):
+            signals.hook_event.send(sender=User, action='pinged', instance=self.user, user=self.user.pk)
+        replay.flush()
+        self.assertEquals(str(self.user.pk), models.EventLog.objects.get(event=user_hook.event).user_pk)
+
+    @patch('rest_hooks.models.client.post')
+    def test_in_memory_transport(self, method_mock):
+        from rest_hooks.transports import get_transport
+
+        for n in range(3):
+            self.make_hook('comment.added', 'http://example.com/in_memory/%s' % n)
+        sent = MagicMock()
+        signals.hook_sent_event.connect(sent)
+
+        with override_settings(HOOK_TRANSPORT='rest_hooks.transports.InMemoryTransport'):
+            transport = get_transport()
+            with patch.object(transport, 'send_many', wraps=transport.send_many) as send_many:
+                comment = Comment.objects.create(
+                    site=self.site, content_object=self.user, user=self.user, comment='Hello world!'
+                )
+            # every hook of the event in one batch
+            send_many.assert_called_once_with(ANY)
+            self.assertEquals(3, len(transport.outbox))
+            delivery = transport.outbox[0]
+            self.assertEquals(comment.pk, json.loads(delivery.data)['data']['pk'])
+            self.assertEquals('application/json', delivery.headers['Content-Type'])
+        signals.hook_sent_event.disconnect(sent)
+
+        self.assertFalse(method_mock.called)
+        self.assertEquals(3, sent.call_count)
+        self.assertIsNot(transport, get_transport())
+
+    @patch('requests.Session.post')
+    def test_threaded_transport(self, method_mock):
+        from rest_hooks.transports import get_transport
+
+        method_mock.return_value = MagicMock(status_code=200)
+        for n in range(3):
+            self.make_hook('special.thing', 'http://example.com/threaded/%s' % n)
+        with override_settings(HOOK_TRANSPORT='rest_hooks.transports.ThreadedTransport'):
+            client = get_transport().client
+            models.raw_custom_event(sender=None, event_name='special.thing', payload={'a': 1}, user=self.user)
+            self.assertEquals(3, client.stats['enqueued'])
+        # closing the transport drained the queue
+        self.assertEquals(3, client.stats['sent'])
+        self.assertEquals(3, method_mock.call_count)
+
+    def test_asyncio_transport_threads(self):
+        import threading
+        from rest_hooks.transports import AsyncioTransport, Delivery
+
+        transport = AsyncioTransport()
+        sessions = []
+        threads = [threading.Thread(target=lambda: sessions.append(transport.session)) for n in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # a session per thread
+        self.assertIsNot(sessions[0], sessions[1])
+        self.assertIs(transport.session, transport.session)
+
+        hook = self.make_hook('special.thing', 'http://example.com/asyncio')
+        with patch.object(Hook, 'send_request') as send_request:
+            transport.post(Delivery(hook, {}, '{}'))
+        send_request.assert_called_once_with(ANY, using=transport.session, close_connection=True)
+        transport.close()
+
+    def test_transport_batches(self):
+        import sys
+        from rest_hooks.payloads import splice_payload
+        from rest_hooks.transports import CeleryTransport, get_transport
+
+        for n in range(3):
+            self.make_hook('special.thing', 'http://example.com/batches/%s' % n)
+        with override_settings(HOOK_TRANSPORT='rest_hooks.transports.InMemoryTransport',
+                               HOOK_TRANSPORT_BATCH_SIZE=2):
+            transport = get_transport()
+            with patch.object(transport, 'send_many', wraps=transport.send_many) as send_many:
+                models.raw_custom_event(sender=None, event_name='special.thing', payload={'a': 1}, user=self.user)
+            self.assertEquals([2, 1], [len(call[1][0]) for call in send_many.mock_calls])
+            deliveries = transport.outbox
+
+        # the shared data goes to celery once, the bodies are spliced in the task
+        tasks = MagicMock()
+        with patch.dict(sys.modules, {'rest_hooks.tasks': tasks}):
+            CeleryTransport().send_many(deliveries)
+        tasks.DeliverHooks.delay.assert_called_once_with(ANY, data='{"a": 1}')
+        sent = tasks.DeliverHooks.delay.mock_calls[0][1][0]
+        self.assertEquals(3, len(sent))
+        for task, delivery in zip(sent, deliveries):
+            self.assertNotIn('data', task)
+            self.assertEquals(delivery.data, splice_payload(task['hook'].encode('utf-8'), b'{"a": 1}'))
+
+    def test_lookup_database(self):
+        from rest_hooks import delivery_log, utils
+
+        self.assertIsNone(utils.get_lookup_database())
+        with override_settings(HOOK_LOOKUP_DATABASE='replica', HOOK_LOOKUP_PIN_SECONDS=5):
+            self.make_hook('special.thing', 'http://example.com/test_lookup_database')
+            # subscriptions just changed, stay on the primary
+            self.assertEquals('default', utils.get_lookup_database())
+            with patch('rest_hooks.utils._subscriptions_changed_at', time.time() - 10):
+                self.assertEquals('replica', utils.get_lookup_database())
+            Hook.objects.bulk_unsubscribe(event='special.thing')
+            self.assertEquals('default', utils.get_lookup_database())
+
+        self.assertEquals('default', delivery_log.get_database())
+        with override_settings(HOOK_LOG_DATABASE='logs'):
+            self.assertEquals('logs', delivery_log.get_database())
+
+    @override_settings(HOOK_TRANSPORT='rest_hooks.transports.InMemoryTransport')
+    def test_lookup_database_is_queried(self):
+        from django.db.models.query import QuerySet
+        from rest_hooks.transports import get_transport
+
+        self.make_hook('special.thing', 'http://example.com/test_lookup_database_is_queried')
+        aliases = []
+        using = QuerySet.using
+
+        def spy(queryset, alias):
+            # there's no replica in the tests, the query still runs on default
+            aliases.append(alias)
+            return using(queryset, 'default')
+
+        with patch('rest_hooks.utils.get_lookup_database', return_value='replica'):
+            with patch.object(QuerySet, 'using', spy):
+                with patch('rest_hooks.utils.router.db_for_write', return_value='primary'):
+                    models.raw_custom_event(sender=None, event_name='special.thing', payload={}, user=self.user)
+        self.assertEquals(['replica'], aliases)
+        hook = get_transport().outbox[0].hook
+        # writes to the looked up hook go to the primary
+        self.assertEquals('primary', hook._state.db)
+
+    @patch('rest_hooks.models.client.post')
+    def test_raw_event_with_overridden_deliver_hook(self, method_mock):
+        from rest_hooks.signals import raw_hook_event
+
+        hook = self.make_hook('special.thing', 'http://example.com/legacy')
+        with patch.object(Hook, 'deliver_hook', legacy_deliver_hook):
+            raw_hook_event.send(sender=None, event_name='special.thing', payload={'hello': 'world'}, user=self.user)
+
+        self.assertEquals(
+            {'hook': hook.dict(), 'data': {'hello': 'world'}},
+            json.loads(method_mock.mock_calls[0][2]['data'])
+        )
+
+    @patch('rest_hooks.models.client.post')
+    def test_model_event_with_overridden_deliver_hook(self, method_mock):
+        hook = self.make_hook('comment.added', 'http://example.com/legacy')
+        with patch.object(Hook, 'deliver_hook', legacy_deliver_hook):
+            comment = Comment.objects.create(
+                site=self.site, content_object=self.user, user=self.user, comment='Hello world!'
+            )
+
+        payload = json.loads(method_mock.mock_calls[0][2]['data'])
+        self.assertEquals(hook.dict(), payload['hook'])
+        self.assertEquals(comment.pk, payload['data']['pk'])
+        self.assertEquals('Hello world!', payload['data']['fields']['comment'])
+
     def test_signal_emitted_upon_success(self):
         wrapper = lambda *args, **kwargs: None
         mock_handler = MagicMock(wraps=wrapper)
@@ -285,6 +879,177 @@ class RESTHooksTest(TestCase):
         payload['data']['fields']['submit_date'] = ANY
         mock_handler.assert_called_with(signal=ANY, sender=Hook, payload=payload, instance=comment, hook=hook)
 
+    def test_bulk_subscribe_and_unsubscribe(self):
+        changes = MagicMock()
+        signals.hooks_bulk_changed.connect(changes, sender=Hook)
+
+        hooks = Hook.objects.bulk_subscribe(
+            [{'user': self.user, 'event': 'comment.added', 'target': 'http://example.com/%s' % n} for n in range(10)]
+        )
+        self.assertEquals(10, len(hooks))
+        self.assertEquals(10, Hook.objects.filter(user=self.user).count())
+
+        deleted_hooks = MagicMock()
+        post_delete.connect(deleted_hooks, sender=Hook)
+        # per chunk: the pks, and a DELETE
+        with self.assertNumQueries(8):
+            deleted = Hook.objects.bulk_unsubscribe(chunk_size=3, user=self.user)
+        post_delete.disconnect(deleted_hooks, sender=Hook)
+        self.assertEquals(10, deleted)
+        self.assertFalse(deleted_hooks.called)
+        self.assertFalse(Hook.objects.exists())
+
+        self.assertEquals(['subscribe', 'unsubscribe'], [call[2]['action'] for call in changes.mock_calls])
+        signals.hooks_bulk_changed.disconnect(changes, sender=Hook)
+
+    def test_bulk_subscribe_invalid_event(self):
+        from django.core.exceptions import ValidationError
+
+        with self.assertRaises(ValidationError):
+            Hook.objects.bulk_subscribe([
+                {'user': self.user, 'event': 'comment.added', 'target': 'http://example.com/'},
+                {'user': self.user, 'event': 'not.an.event', 'target': 'http://example.com/'},
+            ])
+        self.assertFalse(Hook.objects.exists())
+
+    @patch('rest_hooks.models.client.post')
+    def test_subscribe_is_idempotent(self, method_mock):
+        target = 'http://example.com/test_subscribe_is_idempotent'
+
+        hook, created = Hook.objects.subscribe(self.user, 'comment.added', target)
+        self.assertTrue(created)
+        for n in range(3):
+            same_hook, created = Hook.objects.subscribe(self.user, 'comment.added', target)
+            self.assertFalse(created)
+            self.assertEquals(hook.id, same_hook.id)
+
+        Hook.objects.bulk_subscribe([
+            {'user': self.user, 'event': 'comment.changed', 'target': target},
+            {'user': self.user, 'event': 'comment.changed', 'target': target},
+        ])
+        self.assertEquals(2, Hook.objects.count())
+
+        Comment.objects.create(
+            site=self.site,
+            content_object=self.user,
+            user=self.user,
+            comment='Hello world!'
+        )
+        self.assertEquals(1, len(method_mock.mock_calls))
+
+    @patch('rest_hooks.models.client.post')
+    def test_hook_condition(self, method_mock):
+        matching = self.make_hook('comment.added', 'http://example.com/matching')
+        matching.condition = "comment == 'Hello world!' and user == {0}".format(self.user.pk)
+        matching.save()
+        other = self.make_hook('comment.added', 'http://example.com/other')
+        other.condition = "is_public and comment != 'Hello world!'"
+        other.save()
+
+        with patch.object(Hook, 'serialize_hook', autospec=True, side_effect=Hook.serialize_hook) as serialize:
+            Comment.objects.create(
+                site=self.site,
+                content_object=self.user,
+                user=self.user,
+                comment='Hello world!'
+            )
+        self.assertEquals(['http://example.com/matching'], [call[2]['url'] for call in method_mock.mock_calls])
+        # the filtered hook never paid for serialization
+        self.assertEquals([matching], [call[1][0] for call in serialize.mock_calls])
+
+    def test_hook_condition_validation(self):
+        from django.core.exceptions import ValidationError
+
+        too_deep = ['not ' * 5000 + 'x', 'not ' * 100 + 'x', 'x == ' + '[' * 50 + ']' * 50, 'x == 1 or ' * 300 + 'y']
+        for condition in ["__import__('os')", 'status == ', 'status.__class__ == 1', 'len(items) > 1'] + too_deep:
+            hook = Hook(user=self.user, event='comment.added', target='http://example.com/', condition=condition)
+            with self.assertRaises(ValidationError):
+                hook.clean()
+
+        hook = Hook(user=self.user, event='comment.added', target='http://example.com/',
+                    condition="status == 'paid' or not (total < -1.5)")
+        hook.clean()
+        self.assertTrue(hook.matches({'status': 'paid'}))
+        self.assertTrue(hook.matches({'status': 'open', 'total': 10}))
+        self.assertFalse(hook.matches({'status': 'open', 'total': -10}))
+        # comparing against a missing attribute is simply false
+        self.assertTrue(hook.matches({}))
+
+    def test_hook_condition_only_sees_payload_fields(self):
+        comment = Comment.objects.create(
+            site=self.site, content_object=self.user, user=self.user, comment='Hello world!'
+        )
+        hook = Hook(user=self.user, event='comment.added', target='http://example.com/')
+        hook.condition = "comment == 'Hello world!'"
+        self.assertTrue(hook.matches(comment))
+
+        # related objects and fields outside the payload can't be probed
+        for condition in ["user.password > ''", "user.password == None", "user.username == 'bob'"]:
+            hook.condition = condition
+            self.assertEquals(condition.endswith('None'), hook.matches(comment))
+        hook.payload_fields = 'user'
+        hook.condition = "comment == None and user == {0}".format(self.user.pk)
+        self.assertTrue(hook.matches(comment))
+
+    @patch('rest_hooks.models.client.post')
+    def test_payload_field_projection(self, method_mock):
+        from rest_hooks.serializers import serialize_instance
+
+        events = dict(HOOK_EVENTS_OVERRIDE)
+        events['comment.added'] = {'action': events['comment.added'], 'fields': ['comment', 'user']}
+
+        with override_settings(HOOK_EVENTS=events):
+            for n in range(3):
+                self.make_hook('comment.added', 'http://example.com/event_fields/%s' % n)
+            hook = self.make_hook('comment.added', 'http://example.com/hook_fields')
+            hook.payload_fields = 'comment'
+            hook.save()
+
+            with patch('rest_hooks.serializers.serialize_instance', wraps=serialize_instance) as serialize:
+                comment = Comment.objects.create(
+                    site=self.site,
+                    content_object=self.user,
+                    user=self.user,
+                    comment='Hello world!'
+                )
+        # one serialization per distinct projection
+        self.assertEquals(2, serialize.call_count)
+
+        payloads = dict((call[2]['url'], json.loads(call[2]['data'])) for call in method_mock.mock_calls)
+        self.assertEquals(4, len(payloads))
+        self.assertEquals({'comment': 'Hello world!', 'user': self.user.id},
+                          payloads['http://example.com/event_fields/0']['data']['fields'])
+        self.assertEquals({'comment': 'Hello world!'}, payloads['http://example.com/hook_fields']['data']['fields'])
+        self.assertEquals(comment.id, payloads['http://example.com/hook_fields']['data']['pk'])
+        self.assertEquals(hook.id, payloads['http://example.com/hook_fields']['hook']['id'])
+
+    @override_settings(HOOK_EVENTS=PREFETCH_HOOK_EVENTS, HOOK_SERIALIZER='rest_hooks.tests.serialize_with_groups')
+    @patch('rest_hooks.models.client.post')
+    def test_prefetch_related_for_event(self, method_mock):
+        from django.contrib.auth.models import Group
+        from rest_hooks.signals import hook_event
+        from rest_hooks.utils import distill_model_events
+
+        group = Group.objects.create(name='readers')
+        users = [User.objects.create_user('user%s' % n) for n in range(3)]
+        for user in users:
+            user.groups.add(group)
+            for n in range(3):
+                Hook.objects.create(user=user, event='user.pinged', target='http://example.com/pinged/%s' % n)
+
+        user = User.objects.get(pk=users[0].pk)
+        # hooks lookup + one prefetch, however many hooks there are
+        with self.assertNumQueries(2):
+            hook_event.send(sender=User, action='pinged', instance=user)
+        self.assertEquals(3, len(method_mock.mock_calls))
+        self.assertEquals(['readers'], json.loads(method_mock.mock_calls[0][2]['data'])['data']['groups'])
+
+        batch = User.objects.filter(pk__in=[u.pk for u in users])
+        # loading the batch, one prefetch for all of it + a hooks lookup per instance
+        with self.assertNumQueries(5):
+            distill_model_events(batch, 'auth.User', 'pinged')
+        self.assertEquals(12, len(method_mock.mock_calls))
+
     def test_valid_form(self):
 
         form_data = {
@@ -307,6 +1072,74 @@ class RESTHooksTest(TestCase):
         instance = form.save()
         self.assertIsInstance(instance, Hook)
 
+    @patch('rest_hooks.models.client.post')
+    def test_admin_bulk_actions(self, method_mock):
+        from django.contrib.admin.sites import AdminSite
+        from django.core.exceptions import PermissionDenied
+        from django.template.loader import get_template
+        from django.template.response import TemplateResponse
+        from django.test import RequestFactory
+        from rest_hooks.admin import HookAdmin, enable_hooks, disable_hooks, delete_hooks
+
+        model_admin = HookAdmin(Hook, AdminSite())
+        model_admin.message_user = MagicMock()
+        for n in range(3):
+            self.make_hook('special.thing', 'http://example.com/admin/%s' % n)
+        queryset = Hook.objects.filter(target__in=['http://example.com/admin/0', 'http://example.com/admin/1'])
+        admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        request = RequestFactory().post('/')
+        request.user = admin_user
+
+        with self.assertNumQueries(1):
+            disable_hooks(model_admin, request, queryset)
+        self.assertEquals(1, Hook.objects.filter(event='special.thing', is_active=True).count())
+        models.raw_custom_event(sender=None, event_name='special.thing', payload={}, user=self.user)
+        self.assertEquals(1, len(method_mock.mock_calls))
+
+        with self.assertNumQueries(1):
+            enable_hooks(model_admin, request, queryset)
+
+        request = RequestFactory().post('/', {'select_across': '1', '_selected_action': ['1', '2']})
+        request.user = admin_user
+        # asks for confirmation first, with a count
+        with self.assertNumQueries(1):
+            response = delete_hooks(model_admin, request, queryset)
+        self.assertIsInstance(response, TemplateResponse)
+        self.assertEquals(2, response.context_data['count'])
+        self.assertTrue(response.context_data['select_across'])
+        self.assertEquals(['1', '2'], response.context_data['selected'])
+        get_template(response.template_name)
+        self.assertEquals(3, Hook.objects.filter(event='special.thing').count())
+
+        changes = MagicMock()
+        signals.hooks_bulk_changed.connect(changes, sender=Hook)
+        request = RequestFactory().post('/', {'post': 'yes'})
+        request.user = admin_user
+        # the pks, and one DELETE
+        with self.assertNumQueries(2):
+            self.assertIsNone(delete_hooks(model_admin, request, queryset))
+        signals.hooks_bulk_changed.disconnect(changes, sender=Hook)
+        self.assertEquals(1, changes.call_count)
+
+        request.user = User.objects.create_user('staff', 'staff@example.com', 'password')
+        with self.assertRaises(PermissionDenied):
+            delete_hooks(model_admin, request, queryset)
+        self.assertEquals(['http://example.com/admin/2'],
+                          list(Hook.objects.filter(event='special.thing').values_list('target', flat=True)))
+        self.assertNotIn('delete_selected', model_admin.get_actions(MagicMock()))
+
+    def test_admin_events_and_paginator(self):
+        from rest_hooks.admin import EstimatedCountPaginator
+
+        self.assertIs(HookForm.get_admin_events(), HookForm.get_admin_events())
+        with override_settings(HOOK_EVENTS=ALT_HOOK_EVENTS):
+            self.assertEquals(len(ALT_HOOK_EVENTS), len(HookForm.get_admin_events()))
+
+        for n in range(3):
+            self.make_hook('special.thing', 'http://example.com/paginated/%s' % n)
+        # exact counts where no estimate is available
+        self.assertEquals(3, EstimatedCountPaginator(Hook.objects.order_by('pk'), 2).count)
+
     def test_invalid_form(self):
         form = HookForm(data={})
         self.assertFalse(form.is_valid())
@@ -0,0 +1,225 @@
+import threading
+
+from django.conf import settings
+
+from rest_hooks import delivery_log
+from rest_hooks.utils import get_module
+
+
+class Delivery(object):
+    """
+    One encoded payload on its way to a hook.
+
+    `data` is the exact body that gets POSTed, bytes if the hook signs it.
+    `shared` is the `PreEncodedPayload` it was spliced from, if any.
+    """
+
+    def __init__(self, hook, payload, data, instance=None, shared=None):
+        self.hook = hook
+        self.payload = payload
+        self.instance = instance
+        self.shared = shared
+        self.request = hook.get_request(data)
+
+    @property
+    def url(self):
+        return self.request['url']
+
+    @property
+    def data(self):
+        return self.request['data']
+
+    @property
+    def headers(self):
+        return self.request['headers']
+
+
+class BaseTransport(object):
+    """
+    Puts encoded deliveries on the wire. `find_and_fire_hook` hands all the
+    deliveries of an event to `send_many()` at once, so transports can batch
+    them natively.
+    """
+
+    def send(self, delivery):
+        self.send_many([delivery])
+
+    def send_many(self, deliveries):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class DefaultTransport(BaseTransport):
+    """
+    Posts with the shared `rest_hooks.models.client`: the threaded `Client`,
+    or a `requests.Session` if `settings.HOOK_THREADING` is False.
+    """
+
+    def send_many(self, deliveries):
+        for delivery in deliveries:
+            delivery.hook.send_request(delivery.request)
+
+
+class RequestsTransport(BaseTransport):
+    """
+    Posts synchronously, one after the other, on a session of its own.
+    """
+
+    def __init__(self):
+        import requests
+        self.session = requests.Session()
+
+    def send_many(self, deliveries):
+        for delivery in deliveries:
+            delivery.hook.send_request(delivery.request, using=self.session)
+
+
+class ThreadedTransport(BaseTransport):
+    """
+    Queues the whole batch on a threaded `Client` of its own, with a single
+    lock acquisition.
+    """
+
+    def __init__(self, **kwargs):
+        from rest_hooks.models import build_client_options
+        from rest_hooks.client import Client
+        options = build_client_options()
+        options.update(kwargs)
+        self.client = Client(**options)
+
+    def send_many(self, deliveries):
+        requests = []
+        for delivery in deliveries:
+            request = dict(delivery.request)
+            if delivery_log.is_enabled():
+                request['context'] = delivery_log.get_context(delivery.hook)
+            requests.append(request)
+        self.client.enqueue_many('post', requests)
+
+    def close(self):
+        self.client.close()
+
+
+class AsyncioTransport(BaseTransport):
+    """
+    Sends each batch concurrently from an asyncio event loop running in a
+    background thread. `requests` is blocking, so every POST runs in the
+    loop's default executor, on a session per executor thread (sessions
+    aren't thread-safe); `send_many` returns without waiting.
+    """
+
+    def __init__(self):
+        import asyncio
+        self.local = threading.local()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def send_many(self, deliveries):
+        self.loop.call_soon_threadsafe(self.schedule, list(deliveries))
+
+    def schedule(self, deliveries):
+        # runs in the loop's thread
+        for delivery in deliveries:
+            self.loop.run_in_executor(None, self.post, delivery)
+
+    @property
+    def session(self):
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            import requests
+            session = self.local.session = requests.Session()
+        return session
+
+    def post(self, delivery):
+        # runs in an executor thread, which closes its database connection
+        # after writing the delivery log
+        try:
+            delivery.hook.send_request(delivery.request, using=self.session, close_connection=True)
+        except Exception:
+            # nobody is waiting for the result
+            pass
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+class CeleryTransport(BaseTransport):
+    """
+    Sends each batch as `rest_hooks.tasks.DeliverHooks` tasks, one per
+    shared payload: its data goes into the task once, next to the small
+    per-hook envelopes the task splices the bodies from.
+    """
+
+    def send_many(self, deliveries):
+        from rest_hooks.tasks import DeliverHooks
+        groups = {}
+        for delivery in deliveries:
+            groups.setdefault(id(delivery.shared), (delivery.shared, []))[1].append(delivery)
+
+        for shared, group in groups.values():
+            tasks = []
+            for delivery in group:
+                task = {'url': delivery.url, 'headers': delivery.headers, 'hook_id': delivery.hook.pk}
+                if shared is not None:
+                    task['hook'] = shared.encode_envelope(delivery.hook).decode('utf-8')
+                else:
+                    task['data'] = decode(delivery.data)
+                tasks.append(task)
+            if shared is not None:
+                DeliverHooks.delay(tasks, data=decode(shared.encoded_data))
+            else:
+                DeliverHooks.delay(tasks)
+
+
+def decode(data):
+    return data.decode('utf-8') if isinstance(data, bytes) else data
+
+
+class InMemoryTransport(BaseTransport):
+    """
+    Records deliveries in `outbox` instead of sending them, for tests and
+    benchmarks of the dispatch pipeline without network I/O.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.outbox = []
+
+    def send_many(self, deliveries):
+        with self.lock:
+            self.outbox.extend(deliveries)
+
+    def clear(self):
+        with self.lock:
+            self.outbox = []
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport():
+    """
+    The transport instance configured by `settings.HOOK_TRANSPORT`, built
+    once.
+    """
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                path = getattr(settings, 'HOOK_TRANSPORT', None)
+                _transport = get_module(path)() if path else DefaultTransport()
+    return _transport
+
+
+def reset_transport():
+    global _transport
+    with _transport_lock:
+        transport, _transport = _transport, None
+    if transport is not None:
+        transport.close()
@@ -1,3 +1,5 @@
+import time
+
 import django
 
 try:
@@ -6,6 +8,18 @@ except ImportError:
     django_apps = None
 from django.core.exceptions import ImproperlyConfigured
 from django.conf import settings
+from django.db import router
+
+try:
+    from django.db.models import prefetch_related_objects
+except ImportError:
+    # Django < 1.10
+    from django.db.models.query import prefetch_related_objects as _prefetch_related_objects
+
+    def prefetch_related_objects(model_instances, *related_lookups):
+        _prefetch_related_objects(model_instances, related_lookups)
+
+from rest_hooks import profiling
 
 if django.VERSION >= (2, 0,):
     get_model_kwargs = {'require_ready': False}
@@ -73,6 +87,117 @@ def get_hook_model():
 
 
 
+# when this process last changed subscriptions, see get_lookup_database()
+_subscriptions_changed_at = 0
+
+
+def subscriptions_changed():
+    global _subscriptions_changed_at
+    _subscriptions_changed_at = time.time()
+
+
+def get_lookup_database():
+    """
+    The database alias hooks are looked up from when events fire:
+    `settings.HOOK_LOOKUP_DATABASE` (e.g. a read replica), except for
+    `HOOK_LOOKUP_PIN_SECONDS` after this process changed subscriptions, when
+    reads stay on the primary so new hooks aren't missed to replication lag.
+
+    None leaves the choice to the database routers.
+    """
+    alias = getattr(settings, 'HOOK_LOOKUP_DATABASE', None)
+    if alias is None:
+        return None
+    pin_seconds = getattr(settings, 'HOOK_LOOKUP_PIN_SECONDS', 5.0)
+    if time.time() - _subscriptions_changed_at < pin_seconds:
+        return router.db_for_write(get_hook_model())
+    return alias
+
+
+def get_log_database():
+    """
+    The database alias of the delivery and event logs,
+    `settings.HOOK_LOG_DATABASE`; None leaves the choice to the routers.
+    """
+    return getattr(settings, 'HOOK_LOG_DATABASE', None)
+
+
+def delete_in_chunks(queryset, chunk_size=1000, sleep=0, using=None, raw=False):
+    """
+    Delete the rows of `queryset` by primary key, `chunk_size` rows per
+    statement, so no single DELETE holds locks on a large part of the table.
+    Sleeps `sleep` seconds between chunks to leave room for other writers.
+
+    With `raw` each chunk is a plain DELETE: the rows aren't loaded, no
+    `pre_delete`/`post_delete` signals are sent and nothing cascades.
+
+    Returns the number of deleted rows.
+    """
+    queryset = queryset.order_by('pk')
+    manager = queryset.model._default_manager
+    if using is not None:
+        queryset = queryset.using(using)
+        manager = manager.db_manager(using)
+    deleted = 0
+    while True:
+        pks = list(queryset.values_list('pk', flat=True)[:chunk_size])
+        if not pks:
+            break
+        chunk = manager.filter(pk__in=pks)
+        raw_delete = getattr(chunk, '_raw_delete', None) if raw else None
+        if raw_delete is not None:
+            raw_delete(chunk.db)
+        else:
+            # Django < 1.9 has no raw delete
+            chunk.delete()
+        deleted += len(pks)
+        if len(pks) < chunk_size:
+            break
+        if sleep:
+            time.sleep(sleep)
+    return deleted
+
+
+def get_condition_subject(instance, payload_override=None, fields=None):
+    """
+    What hook conditions are evaluated against: the field values of the
+    instance in the `fields` projection, or the data of a raw event.
+    """
+    from rest_hooks.payloads import PreEncodedPayload
+    from rest_hooks.serializers import condition_values
+
+    if instance is not None:
+        return condition_values(instance, fields)
+    if isinstance(payload_override, PreEncodedPayload):
+        return payload_override.data
+    if isinstance(payload_override, dict):
+        return payload_override
+    return None
+
+
+def prefetch_for_event(event_name, instances):
+    """
+    Load the `select_related` and `prefetch_related` lookups configured for
+    `event_name` in settings.HOOK_EVENTS onto already fetched instances, with
+    one query per lookup for the whole batch. Lookups that are already
+    cached on the instances are skipped.
+
+        'book.added': {
+            'action': 'bookstore.Book.created',
+            'select_related': ['author'],
+            'prefetch_related': ['tags'],
+        }
+    """
+    from rest_hooks.models import get_event_config
+
+    config = get_event_config(event_name)
+    lookups = list(config.get('select_related') or ()) + list(config.get('prefetch_related') or ())
+    instances = [instance for instance in instances if instance is not None]
+    if lookups and instances:
+        prefetch_related_objects(instances, *lookups)
+    return instances
+
+
 def find_and_fire_hook(event_name, instance, user_override=None, payload_override=None):
     """
     Look up Hooks that apply
@@ -82,14 +207,19 @@ def find_and_fire_hook(event_name, instance, user_override=None, payload_overrid
         User = get_user_model()
     except ImportError:
         from django.contrib.auth.models import User
-    from rest_hooks.models import HOOK_EVENTS
+    from rest_hooks.models import HOOK_EVENTS, get_model_label
+    from rest_hooks import replay
+    from rest_hooks.payloads import PreEncodedPayload
+    from rest_hooks.serializers import serialize_instance
+
+    started = profiling.start()
 
     if event_name not in HOOK_EVENTS.keys():
         raise Exception(
             '"{}" does not exist in `settings.HOOK_EVENTS`.'.format(event_name)
         )
 
-    filters = {'event': event_name}
+    filters = {'event': event_name, 'is_active': True}
 
     # Ignore the user if the user_override is False
     if user_override is not False:
@@ -112,8 +242,83 @@ def find_and_fire_hook(event_name, instance, user_override=None, payload_overrid
     HookModel = get_hook_model()
 
     hooks = HookModel.objects.filter(**filters)
+    using = get_lookup_database()
+    if using is not None:
+        hooks = list(hooks.using(using))
+        # read from the replica, but saves and deletes (e.g. on a 410) must
+        # go to the primary
+        write_alias = router.db_for_write(HookModel)
+        for hook in hooks:
+            hook._state.db = write_alias
+    else:
+        hooks = list(hooks)
+    if hooks and payload_override is None and replay.is_enabled():
+        # events with their own payload can't be rebuilt, and events nobody
+        # subscribed to have nobody to be replayed to: neither is logged
+        replay.record_event(event_name, instance, filters.get('user'))
+    if hooks and instance is not None:
+        # related objects the serializers need are loaded once, not per hook
+        prefetch_for_event(event_name, [instance])
+    # per payload projection, conditions only see what the hook is sent
+    subjects = {}
+    model_label = get_model_label(instance)
+    projections = {}
+    # safety net against duplicate subscriptions: POST once per target
+    delivered = set()
+    # handed to the transport in batches, so only that many bodies are held at once
+    batch_size = getattr(settings, 'HOOK_TRANSPORT_BATCH_SIZE', 100)
+    batch = []
     for hook in hooks:
-        hook.deliver_hook(instance, payload_override=payload_override)
+        # filtered before anything gets serialized
+        if hook.condition:
+            fields = hook.get_payload_fields() if instance is not None else None
+            if fields not in subjects:
+                subjects[fields] = get_condition_subject(instance, payload_override, fields)
+            if not hook.matches(subjects[fields]):
+                continue
+        key = (hook.user_id, hook.target)
+        if key in delivered:
+            continue
+        delivered.add(key)
+
+        if len(batch) >= batch_size:
+            send_batch(batch, instance)
+            batch = []
+
+        hook_payload = payload_override
+        if not hook.uses_default_delivery():
+            # an overridden deliver_hook serializes the instance itself
+            hook.deliver_hook(instance, payload_override=hook_payload)
+            continue
+        if hook_payload is None and hook.uses_default_serializer(instance):
+            # hooks asking for the same fields share one serialization and encoding
+            fields = hook.get_payload_fields()
+            if fields not in projections:
+                with profiling.profile('serialize', event_name, model_label):
+                    projections[fields] = PreEncodedPayload(serialize_instance(instance, fields=fields))
+            hook_payload = projections[fields]
+        batch.append(hook.prepare_delivery(instance, payload_override=hook_payload))
+
+    if batch:
+        send_batch(batch, instance)
+
+    profiling.record('find', started, event_name, model_label)
+
+
+def send_batch(batch, instance):
+    """
+    Hand a batch of deliveries of `instance` to the transport.
+    """
+    from rest_hooks.models import get_model_label
+    from rest_hooks.transports import get_transport
+
+    started = profiling.start()
+    get_transport().send_many(batch)
+    if started is not None:
+        # one `deliver` timing per batch, the transport sends it as a whole
+        profiling.record('deliver', started, batch[0].hook.event, get_model_label(instance))
+    for delivery in batch:
+        delivery.hook.delivery_sent(delivery.payload, instance)
 
 
 def distill_model_event(
@@ -138,7 +343,9 @@ def distill_model_event(
     If payload_override is passed, then it will be passed into HookModel.deliver_hook
 
     """
-    from rest_hooks.models import get_event_actions_config, HOOK_EVENTS
+    from rest_hooks.models import get_event_actions_config, get_event_config, HOOK_EVENTS
+
+    started = profiling.start()
 
     if event_name is False and (model is False or action is False):
         raise TypeError(
@@ -149,7 +356,7 @@ def distill_model_event(
         if trust_event_name:
             pass
         elif event_name in HOOK_EVENTS:
-            auto = HOOK_EVENTS[event_name]
+            auto = get_event_config(event_name).get('action')
             if auto:
                 allowed_model, allowed_action = auto.rsplit('.', 1)
 
@@ -176,4 +383,24 @@ def distill_model_event(
             finder = get_module(settings.HOOK_FINDER)
         else:
             finder = find_and_fire_hook
-        finder(event_name, instance, user_override=user_override, payload_override=payload_override)
+        with profiling.sample(event_name):
+            finder(event_name, instance, user_override=user_override, payload_override=payload_override)
+        profiling.record('distill', started, event_name, model or None)
+
+
+def distill_model_events(instances, model=False, action=False, event_name=False, **kwargs):
+    """
+    `distill_model_event` for a batch of instances of one model. The
+    related lookups configured for the event are prefetched for the whole
+    batch first, so the query count doesn't grow with the batch.
+    """
+    from rest_hooks.models import get_event_actions_config
+
+    instances = list(instances)
+    name = event_name
+    if not name and model and action:
+        name = get_event_actions_config().get(model, {}).get(action, (None, False))[0]
+    if name:
+        prefetch_for_event(name, instances)
+    for instance in instances:
+        distill_model_event(instance, model, action, event_name=event_name, **kwargs)
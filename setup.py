@@ -18,7 +18,10 @@ setup(
     packages=['rest_hooks'],
     package_data={
         'rest_hooks': [
+            'management/*.py',
+            'management/commands/*.py',
             'migrations/*.py',
+            'templates/rest_hooks/*.html',
             'south_migrations/*.py'
         ]
     },